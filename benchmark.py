@@ -0,0 +1,259 @@
+# =============================================================================
+# Benchmark Suite for OpenSeeFace
+# =============================================================================
+#
+# Measures the individual stages of the face tracker on a synthetic frame
+# built from models/benchmark.bin, across combinations of tracking models,
+# face counts, thread counts and frame resolutions. For every combination
+# the full Tracker.predict() call is timed as well as each stage on its own:
+#
+#     detection       Tracker.detect_faces() on the whole frame
+#     retinaface      RetinaFaceDetector.detect_retina() on the whole frame
+#     preprocess      cropping and normalizing all face crops
+#     landmarks       landmark model inference and decoding, per crop
+#     gaze            Tracker.get_eye_state() for all faces
+#     pnp             Tracker.estimate_depth() for all faces
+#     adjust_3d       FaceInfo.adjust_3d() for all faces, minus features
+#     features        FeatureExtractor.update() for all faces
+#     packet          UDP packet serialization of all faces
+#
+# Every sample covers one frame, so stages that run per face are summed over
+# all faces of that frame. Each stage reports p50/p95/p99 and mean latency in
+# milliseconds and its throughput in frames per second. Results can be
+# written as JSON to compare releases or machines.
+#
+# Usage:
+#     results = run_benchmark(models=[3], faces=[1, 4], threads=[1, 4], resolutions=[(640, 360)])
+#     print_results(results)
+#     write_results(results, "benchmark.json")
+#
+# License: BSD 2-clause
+# =============================================================================
+
+import copy
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+import onnxruntime
+
+from packet import PacketWriter
+from tracker import Tracker, get_model_base_path
+
+STAGES = ["frame", "detection", "retinaface", "preprocess", "landmarks", "gaze", "pnp", "adjust_3d", "features", "packet"]
+
+
+def summarize(samples):
+    # Latency percentiles in milliseconds and throughput in calls per second
+    samples = np.array(samples, np.float64) * 1000.
+    if samples.shape[0] == 0:
+        return None
+    mean = float(samples.mean())
+    return {
+        "count": int(samples.shape[0]),
+        "mean_ms": mean,
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "throughput": 1000. / mean if mean > 0 else 0.,
+    }
+
+
+def parse_list(text, type=int):
+    return [type(x) for x in str(text).split(",") if x.strip() != ""]
+
+
+def parse_resolutions(text):
+    resolutions = []
+    for res in str(text).split(","):
+        if res.strip() == "":
+            continue
+        w, h = res.lower().split("x")
+        resolutions.append((int(w), int(h)))
+    return resolutions
+
+
+def make_frame(face, width, height, count):
+    # Tile the benchmark face into a grid on a blank frame and return the frame with the face boxes
+    frame = np.zeros((height, width, 3), np.uint8)
+    cols = int(math.ceil(math.sqrt(count)))
+    rows = int(math.ceil(count / cols))
+    size = min(width // cols, height // rows)
+    if size < 8:
+        raise ValueError(f"Resolution {width}x{height} is too small for {count} faces")
+    tile = cv2.resize(face, (size, size), interpolation=cv2.INTER_AREA)
+    boxes = []
+    for i in range(count):
+        x = (i % cols) * size
+        y = (i // cols) * size
+        frame[y:y+size, x:x+size] = tile
+        boxes.append((x, y, size, size))
+    return frame, boxes
+
+
+def timed(samples, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    samples.append(time.perf_counter() - start)
+    return result
+
+
+def benchmark_config(face, model_type, faces, threads, width, height, frames=100, warmup=10, model_dir=None, retinaface=True, static_model=False):
+    frame, boxes = make_frame(face, width, height, faces)
+    no_gaze = model_type == -1
+    tracker = Tracker(width, height, threshold=0.1, max_threads=threads, max_faces=faces, discard_after=0, scan_every=0, silent=True, model_type=model_type, model_dir=model_dir, no_gaze=no_gaze, detection_threshold=0.1, use_retinaface=False, max_feature_updates=900, static_model=static_model)
+    samples = {stage: [] for stage in STAGES}
+    packet_writer = PacketWriter(faces)
+    try:
+        for i in range(warmup + frames):
+            # Start every frame from the tiled face boxes so the amount of work stays the same
+            tracker.faces = list(boxes)
+            tracker.detected = faces
+            frame_samples = []
+            results = timed(frame_samples, tracker.predict, frame)
+            if i < warmup:
+                continue
+            samples["frame"].extend(frame_samples)
+            timed(samples["detection"], tracker.detect_faces, frame)
+            if retinaface:
+                timed(samples["retinaface"], tracker.retinaface.detect_retina, frame)
+
+            crops = []
+            crop_infos = []
+            tracker.reserve_crops(len(boxes))
+            start = time.perf_counter()
+            for j, (x, y, w, h) in enumerate(boxes):
+                crop = (x, y, x + w, y + h)
+                crops.append(tracker.preprocess(frame, crop, tracker.crop_buffer[j:j+1]))
+                crop_infos.append((x, y, w / tracker.res, h / tracker.res, 0.0))
+            samples["preprocess"].append(time.perf_counter() - start)
+
+            landmarks = []
+            start = time.perf_counter()
+            for crop, crop_info in zip(crops, crop_infos):
+                output = tracker.bound_session.run({tracker.input_name: crop})[0]
+                landmarks.append(tracker.landmarks(output[0], crop_info)[1])
+            samples["landmarks"].append(time.perf_counter() - start)
+
+            if not no_gaze:
+                start = time.perf_counter()
+                for lms in landmarks:
+                    tracker.get_eye_state(frame, lms)
+                samples["gaze"].append(time.perf_counter() - start)
+
+            if len(results) == 0:
+                continue
+            # Work on copies so timing the stages again does not disturb the tracked faces
+            infos = []
+            for f in results:
+                info = copy.copy(f)
+                info.lms = f.lms[0:66]
+                info.face_3d = f.face_3d.copy()
+                info.update_counts = f.update_counts.copy()
+                info.features = copy.deepcopy(f.features)
+                infos.append(info)
+
+            start = time.perf_counter()
+            for info in infos:
+                info.success, info.quaternion, info.euler, info.pnp_error, info.pts_3d, info.lms = tracker.estimate_depth(info)
+            samples["pnp"].append(time.perf_counter() - start)
+
+            feature_level = tracker.feature_level
+            tracker.feature_level = 0
+            start = time.perf_counter()
+            for info in infos:
+                info.adjust_3d()
+            samples["adjust_3d"].append(time.perf_counter() - start)
+            tracker.feature_level = feature_level
+
+            start = time.perf_counter()
+            for info in infos:
+                info.features.update(info.pts_3d[:, 0:2], feature_level == 2)
+            samples["features"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            packet_writer.pack(results, time.time(), width, height)
+            samples["packet"].append(time.perf_counter() - start)
+        tracked = len(tracker.faces)
+    finally:
+        tracker.close()
+
+    stages = {}
+    for stage in STAGES:
+        summary = summarize(samples[stage])
+        if summary is not None:
+            stages[stage] = summary
+    return {
+        "model": model_type,
+        "faces": faces,
+        "tracked_faces": tracked,
+        "threads": threads,
+        "width": width,
+        "height": height,
+        "frames": frames,
+        "gaze": not no_gaze,
+        "fps": stages["frame"]["throughput"],
+        "stages": stages,
+    }
+
+
+def system_info():
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "onnxruntime": onnxruntime.__version__,
+        "providers": onnxruntime.get_available_providers(),
+    }
+
+
+def run_benchmark(models=[3, 2, 1, 0, -1, -2, -3], faces=[1], threads=[1], resolutions=[(640, 360)], frames=100, warmup=10, model_dir=None, retinaface=True, static_model=False, silent=False):
+    face = cv2.imread(os.path.join(get_model_base_path(model_dir), "benchmark.bin"), cv2.IMREAD_COLOR)
+    if face is None:
+        raise FileNotFoundError("Could not load benchmark.bin from the model directory")
+    configs = []
+    for model_type in models:
+        for width, height in resolutions:
+            for face_count in faces:
+                for thread_count in threads:
+                    result = benchmark_config(face, model_type, face_count, thread_count, width, height, frames=frames, warmup=warmup, model_dir=model_dir, retinaface=retinaface, static_model=static_model)
+                    configs.append(result)
+                    if not silent:
+                        print_config(result)
+    return {
+        "version": 1,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "system": system_info(),
+        "settings": {"frames": frames, "warmup": warmup, "retinaface": retinaface, "static_model": static_model},
+        "results": configs,
+    }
+
+
+def print_config(result):
+    print(f"Model {result['model']}, {result['width']}x{result['height']}, {result['faces']} faces ({result['tracked_faces']} tracked), {result['threads']} threads: {result['fps']:.2f} fps")
+    for stage in STAGES:
+        if stage not in result["stages"]:
+            continue
+        s = result["stages"][stage]
+        print(f"    {stage:<11} p50: {s['p50_ms']:8.3f}ms  p95: {s['p95_ms']:8.3f}ms  p99: {s['p99_ms']:8.3f}ms  {s['throughput']:10.2f}/s")
+    sys.stdout.flush()
+
+
+def print_results(results):
+    for result in results["results"]:
+        print_config(result)
+
+
+def write_results(results, filename):
+    with open(filename, "w") as fh:
+        json.dump(results, fh, indent=2)
+        fh.write("\n")
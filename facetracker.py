@@ -7,7 +7,11 @@ import gc
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument("-i", "--ip", help="Set IP address for sending tracking data", default="127.0.0.1")
-parser.add_argument("-p", "--port", type=int, help="Set port for sending tracking data", default=11573)
+parser.add_argument("-p", "--port", type=int, help="Set port for sending tracking data, 0 disables sending to --ip", default=11573)
+parser.add_argument("--target", action="append", help="Add another IP:port to send the same tracking data to, can be given multiple times", default=[])
+parser.add_argument("--vmc-target", action="append", help="Add an IP:port to send the tracking data to using the VMC protocol, e.g. 127.0.0.1:39539 for Warudo, can be given multiple times", default=[])
+parser.add_argument("--vmc-epsilon", type=float, help="Only send VMC blend shape values that changed by more than this", default=0.005)
+parser.add_argument("--vmc-keyframe-interval", type=float, help="Seconds after which all VMC blend shape values are sent again, 0 sends all of them every frame", default=1.0)
 if os.name == 'nt':
     parser.add_argument("-l", "--list-cameras", type=int, help="Set this to 1 to list the available cameras and quit, set this to 2 or higher to output only the names", default=0)
     parser.add_argument("-a", "--list-dcaps", type=int, help="Set this to -1 to list all cameras and their available capabilities, set this to a camera id to list that camera's capabilities", default=None)
@@ -31,6 +35,16 @@ parser.add_argument("-P", "--pnp-points", type=int, help="Set this to 1 to add t
 parser.add_argument("-s", "--silent", type=int, help="Set this to 1 to prevent text output on the console", default=0)
 parser.add_argument("--faces", type=int, help="Set the maximum number of faces (slow)", default=1)
 parser.add_argument("--scan-retinaface", type=int, help="When set to 1, scanning for additional faces will be performed using RetinaFace in a background thread, otherwise a simpler, faster face detection mechanism is used. When the maximum number of faces is 1, this option does nothing.", default=0)
+parser.add_argument("--batch-inference", type=int, help="When set to 1, the landmark model runs once on all face crops of a frame as a single batch instead of once per crop, which is faster when tracking multiple faces", default=0)
+parser.add_argument("--motion-model", type=int, help="When set to 1, the movement of each face is followed by a Kalman filter, which places the crop for the next frame at the predicted position of the face, so fast head movements are less likely to lose the face", default=0)
+parser.add_argument("--max-skip", type=int, help="When set above 0, the landmark model is skipped for up to this many frames in a row while the tracked faces hold still, their landmarks are followed with optical flow instead", default=0)
+parser.add_argument("--skip-motion", type=float, help="Set how far, relative to the face size, a face or its features may move before the landmark model runs again when --max-skip is used", default=0.01)
+parser.add_argument("--local-search", type=int, help="When set to 1, lost faces are first searched for with the face detector in a region around their last position and the whole frame is only searched once --discard-after runs out", default=0)
+parser.add_argument("--idle-interval", type=int, help="When set above 1, face detection backs off while no face is found, running every 1, 2, 4... frames up to this interval, and returns to every frame once a face is found", default=0)
+parser.add_argument("--idle-motion", type=float, help="When set above 0 together with --idle-interval, a change of the image by more than this mean gray level difference at low resolution makes face detection run right away, e.g. 3", default=0.0)
+parser.add_argument("--focused-scan", type=int, help="When set to 1, scans for additional faces leave out the faces already tracked and only search regions of the image that changed since the last scan", default=0)
+parser.add_argument("--scan-motion", type=float, help="Set the gray level difference at low resolution that counts as a change for --focused-scan", default=12.0)
+parser.add_argument("--frame-budget", type=float, help="When set above 0, scans for additional faces run less often than --scan-every when they would not fit into this many milliseconds per frame together with tracking", default=0.0)
 parser.add_argument("--scan-every", type=int, help="Set after how many frames a scan for new faces should run", default=3)
 parser.add_argument("--discard-after", type=int, help="Set the how long the tracker should keep looking for lost faces", default=10)
 parser.add_argument("--max-feature-updates", type=int, help="This is the number of seconds after which feature min/max/medium values will no longer be updated once a face has been detected.", default=900)
@@ -40,7 +54,11 @@ parser.add_argument("--video-out", help="Set this to the filename of an AVI file
 parser.add_argument("--video-scale", type=int, help="This is a resolution scale factor applied to the saved AVI file", default=1, choices=[1,2,3,4])
 parser.add_argument("--video-fps", type=float, help="This sets the frame rate of the output AVI file", default=24)
 parser.add_argument("--raw-rgb", type=int, help="When this is set, raw RGB frames of the size given with \"-W\" and \"-H\" are read from standard input instead of reading a video", default=0)
+parser.add_argument("--threaded-capture", type=int, help="When set to 1, OpenCV and V4L2 cameras are read and decoded in a background thread that keeps only the newest frame, so tracking always gets the freshest frame", default=0)
+parser.add_argument("--raw-rgb-path", type=str, help="Set this to a file or named pipe to read the raw RGB frames of --raw-rgb from instead of standard input", default="")
+parser.add_argument("--raw-shm", type=str, help="Set this to the name of a shared memory block written by shm_frames.py to read frames from it instead of reading a video, the frame size is set by the writer", default="")
 parser.add_argument("--log-data", help="You can set a filename to which tracking data will be logged here", default="")
+parser.add_argument("--log-format", type=str, help="Set the format of the tracking data log, either csv or a compact binary format that can be converted to CSV with tracking_log.py", default="csv", choices=["csv", "binary"])
 parser.add_argument("--log-output", help="You can set a filename to console output will be logged here", default="")
 parser.add_argument("--model", type=int, help="This can be used to select the tracking model. Higher numbers are models with better tracking quality, but slower speed, except for model 4, which is wink optimized. Models 1 and 0 tend to be too rigid for expression and blink detection. Model -2 is roughly equivalent to model 1, but faster. Model -3 is between models 0 and -1.", default=3, choices=[-3, -2, -1, 0, 1, 2, 3, 4])
 parser.add_argument("--model-dir", help="This can be used to specify the path to the directory containing the .onnx model files", default=None)
@@ -48,7 +66,22 @@ parser.add_argument("--gaze-tracking", type=int, help="When set to 1, gaze track
 parser.add_argument("--face-id-offset", type=int, help="When set, this offset is added to all face ids, which can be useful for mixing tracking data from multiple network sources", default=0)
 parser.add_argument("--repeat-video", type=int, help="When set to 1 and a video file was specified with -c, the tracker will loop the video until interrupted", default=0)
 parser.add_argument("--dump-points", type=str, help="When set to a filename, the current face 3D points are made symmetric and dumped to the given file when quitting the visualization with the \"q\" key", default="")
-parser.add_argument("--benchmark", type=int, help="When set to 1, the different tracking models are benchmarked, starting with the best and ending with the fastest and with gaze tracking disabled for models with negative IDs", default=0)
+parser.add_argument("--replay", type=str, help="Set this to the filename of a CSV or binary tracking data log to send the logged faces again instead of tracking an input, e.g. to test receivers", default="")
+parser.add_argument("--replay-speed", type=float, help="Set the playback speed of a replayed log relative to its logged timestamps, 0 sends frames as fast as possible", default=1.0)
+parser.add_argument("--replay-copies", type=int, help="Set how many times every replayed face is sent under different face ids to simulate more faces", default=1)
+parser.add_argument("--pipeline", type=int, help="When set to 1, capture, tracking and output run as separate pipelined stages, so reading the next frame overlaps with tracking the current one. Live sources drop old frames when tracking falls behind.", default=0)
+parser.add_argument("--pipeline-depth", type=int, help="Set how many frames may be queued between pipeline stages", default=1)
+parser.add_argument("--metrics-file", type=str, help="Set this to a filename to periodically append tracking metrics (per-stage timings, face counters and events) to as JSON lines", default="")
+parser.add_argument("--metrics-port", type=int, help="Set this to a port to periodically send tracking metrics as JSON to on the local host", default=0)
+parser.add_argument("--metrics-interval", type=float, help="Set how many seconds pass between exported tracking metrics", default=1.0)
+parser.add_argument("--benchmark", type=int, help="When set to 1, the individual tracking stages are benchmarked for every combination of the benchmark models, face counts, thread counts and resolutions, with gaze tracking disabled for model -1", default=0)
+parser.add_argument("--benchmark-models", type=str, help="Set the comma separated list of tracking models to benchmark", default="3,2,1,0,-1,-2,-3")
+parser.add_argument("--benchmark-faces", type=str, help="Set the comma separated list of face counts to benchmark", default="1")
+parser.add_argument("--benchmark-threads", type=str, help="Set the comma separated list of thread counts to benchmark, defaults to the maximum number of threads", default=None)
+parser.add_argument("--benchmark-resolutions", type=str, help="Set the comma separated list of frame resolutions to benchmark, e.g. 640x360,1280x720, defaults to the raw RGB width and height", default=None)
+parser.add_argument("--benchmark-frames", type=int, help="Set the number of frames measured for each benchmark configuration", default=100)
+parser.add_argument("--benchmark-retinaface", type=int, help="When set to 0, the RetinaFace detector is left out of the benchmark", default=1)
+parser.add_argument("--benchmark-output", type=str, help="Set this to a filename to write the benchmark results to as JSON", default="")
 if os.name == 'nt':
     parser.add_argument("--use-dshowcapture", type=int, help="When set to 1, libdshowcapture will be used for video input instead of OpenCV", default=1)
     parser.add_argument("--blackmagic-options", type=str, help="When set, this additional option string is passed to the blackmagic capture library", default=None)
@@ -128,51 +161,84 @@ import numpy as np
 import time
 import cv2
 import socket
-import struct
 import json
+import queue
+import threading
 from input_reader import InputReader, VideoReader, DShowCaptureReader, try_int
 from tracker import Tracker, get_model_base_path
+from pipeline import Stage, END
+from packet import features, PacketWriter
+from replay import ReplaySource
+from vmc_sender import VMCSender
+from metrics import MetricsExporter
+from tracking_log import TrackingLogWriter
 
 if args.benchmark > 0:
-    model_base_path = get_model_base_path(args.model_dir)
-    im = cv2.imread(os.path.join(model_base_path, "benchmark.bin"), cv2.IMREAD_COLOR)
-    results = []
-    for model_type in [3, 2, 1, 0, -1, -2, -3]:
-        tracker = Tracker(224, 224, threshold=0.1, max_threads=args.max_threads, max_faces=1, discard_after=0, scan_every=0, silent=True, model_type=model_type, model_dir=args.model_dir, no_gaze=(model_type == -1), detection_threshold=0.1, use_retinaface=False, max_feature_updates=900, static_model=True if args.no_3d_adapt == 1 else False)
-        tracker.detected = 1
-        tracker.faces = [(0, 0, 224, 224)]
-        total = 0.0
-        for i in range(100):
-            start = time.perf_counter()
-            r = tracker.predict(im)
-            total += time.perf_counter() - start
-        print(1. / (total / 100.))
+    import benchmark
+    threads = args.benchmark_threads if args.benchmark_threads is not None else str(args.max_threads)
+    resolutions = args.benchmark_resolutions if args.benchmark_resolutions is not None else f"{args.width}x{args.height}"
+    results = benchmark.run_benchmark(models=benchmark.parse_list(args.benchmark_models), faces=benchmark.parse_list(args.benchmark_faces), threads=benchmark.parse_list(threads), resolutions=benchmark.parse_resolutions(resolutions), frames=args.benchmark_frames, model_dir=args.model_dir, retinaface=args.benchmark_retinaface != 0, static_model=args.no_3d_adapt == 1)
+    if args.benchmark_output != "":
+        benchmark.write_results(results, args.benchmark_output)
     sys.exit(0)
 
-target_ip = args.ip
-target_port = args.port
+def parse_target(target):
+    ip, sep, port = target.rpartition(":")
+    if sep == "" or ip == "" or not port.isdigit():
+        print(f"Invalid target {target}, expected IP:port.")
+        sys.exit(1)
+    return ip, int(port)
+
+# Every packet format is serialized once per frame and sent to all of its targets
+targets = []
+if args.port > 0:
+    targets.append((args.ip, args.port))
+targets += [parse_target(target) for target in args.target]
+vmc_sender = None
+for target in args.vmc_target:
+    ip, port = parse_target(target)
+    if vmc_sender is None:
+        vmc_sender = VMCSender(ip, port, blend_epsilon=args.vmc_epsilon, keyframe_interval=args.vmc_keyframe_interval)
+    else:
+        vmc_sender.add_target(ip, port)
 
 if args.faces >= 40:
     print("Transmission of tracking data over network is not supported with 40 or more faces.")
 
 fps = args.fps
 dcap = None
+# Raw and shared memory frames stay in place until this many newer ones were read, the pipeline keeps a few in flight
+frame_hold = 1
+if args.pipeline != 0:
+    frame_hold = 2 * max(args.pipeline_depth, 1) + 3
 use_dshowcapture_flag = False
-if os.name == 'nt':
+input_reader = None
+if args.replay != "":
+    # Replayed faces come from the log, there is no input to read
+    fps = 0
+    if args.visualize != 0 or args.video_out is not None:
+        print("Visualization is not available when replaying a tracking data log.")
+        args.visualize = 0
+        args.video_out = None
+elif os.name == 'nt':
     dcap = args.dcap
     use_dshowcapture_flag = True if args.use_dshowcapture == 1 else False
-    input_reader = InputReader(args.capture, args.raw_rgb, args.width, args.height, fps, use_dshowcapture=use_dshowcapture_flag, dcap=dcap)
+    input_reader = InputReader(args.capture, args.raw_rgb, args.width, args.height, fps, use_dshowcapture=use_dshowcapture_flag, dcap=dcap, raw_path=args.raw_rgb_path, raw_shm=args.raw_shm, hold=frame_hold, threaded=args.threaded_capture != 0)
     if args.dcap == -1 and type(input_reader) == DShowCaptureReader:
         fps = min(fps, input_reader.device.get_fps())
 elif sys.platform == 'linux' and args.dformat:
-    input_reader = InputReader(args.capture, args.raw_rgb, args.width, args.height, fps, dcap=args.dformat)
+    input_reader = InputReader(args.capture, args.raw_rgb, args.width, args.height, fps, dcap=args.dformat, raw_path=args.raw_rgb_path, raw_shm=args.raw_shm, hold=frame_hold, threaded=args.threaded_capture != 0)
 else:
-    input_reader = InputReader(args.capture, args.raw_rgb, args.width, args.height, fps)
-if type(input_reader.reader) == VideoReader:
+    input_reader = InputReader(args.capture, args.raw_rgb, args.width, args.height, fps, raw_path=args.raw_rgb_path, raw_shm=args.raw_shm, hold=frame_hold, threaded=args.threaded_capture != 0)
+if input_reader is not None and type(input_reader.reader) == VideoReader:
     fps = 0
 
 log = None
 out = None
+metrics_exporter = None
+packet_writer = PacketWriter(args.faces)
+if args.metrics_file != "" or args.metrics_port > 0:
+    metrics_exporter = MetricsExporter(path=args.metrics_file, port=args.metrics_port, interval=args.metrics_interval)
 first = True
 height = 0
 width = 0
@@ -183,35 +249,32 @@ tracking_time = 0.0
 tracking_frames = 0
 frame_count = 0
 
-features = ["eye_l", "eye_r", "eyebrow_steepness_l", "eyebrow_updown_l", "eyebrow_quirk_l", "eyebrow_steepness_r", "eyebrow_updown_r", "eyebrow_quirk_r", "mouth_corner_updown_l", "mouth_corner_inout_l", "mouth_corner_updown_r", "mouth_corner_inout_r", "mouth_open", "mouth_wide"]
-
 if args.log_data != "":
-    log = open(args.log_data, "w")
-    log.write("Frame,Time,Width,Height,FPS,Face,FaceID,RightOpen,LeftOpen,AverageConfidence,Success3D,PnPError,RotationQuat.X,RotationQuat.Y,RotationQuat.Z,RotationQuat.W,Euler.X,Euler.Y,Euler.Z,RVec.X,RVec.Y,RVec.Z,TVec.X,TVec.Y,TVec.Z")
-    for i in range(68):
-        log.write(f",Landmark[{i}].X,Landmark[{i}].Y,Landmark[{i}].Confidence")
-    for i in range(70):
-        log.write(f",Point3D[{i}].X,Point3D[{i}].Y,Point3D[{i}].Z")
-    for feature in features:
-        log.write(f",{feature}")
-    log.write("\r\n")
-    log.flush()
+    log = TrackingLogWriter(args.log_data, format=args.log_format)
 
 is_camera = args.capture == str(try_int(args.capture))
 
-try:
-    attempt = 0
-    frame_time = time.perf_counter()
-    target_duration = 0
-    if fps > 0:
-        target_duration = 1. / float(fps)
-    repeat = args.repeat_video != 0 and type(input_reader.reader) == VideoReader
-    need_reinit = 0
-    failures = 0
-    source_name = input_reader.name
+attempt = 0
+need_reinit = 0
+failures = 0
+frame_time = time.perf_counter()
+target_duration = 0
+if fps > 0:
+    target_duration = 1. / float(fps)
+repeat = args.repeat_video != 0 and input_reader is not None and type(input_reader.reader) == VideoReader
+source_name = input_reader.name if input_reader is not None else ""
+
+def read_frame():
+    # Returns the next input frame, reinitializing the input as needed, or None once the input has ended
+    global input_reader, attempt, need_reinit
     while repeat or input_reader.is_open():
         if not input_reader.is_open() or need_reinit == 1:
-            input_reader = InputReader(args.capture, args.raw_rgb, args.width, args.height, fps, use_dshowcapture=use_dshowcapture_flag, dcap=dcap)
+            # Background grabbers and shared memory mappings stay alive until the old reader is closed
+            try:
+                input_reader.close()
+            except Exception:
+                pass
+            input_reader = InputReader(args.capture, args.raw_rgb, args.width, args.height, fps, use_dshowcapture=use_dshowcapture_flag, dcap=dcap, raw_path=args.raw_rgb_path, raw_shm=args.raw_shm, hold=frame_hold, threaded=args.threaded_capture != 0)
             if input_reader.name != source_name:
                 print(f"Failed to reinitialize camera and got {input_reader.name} instead of {source_name}.")
                 sys.exit(1)
@@ -233,203 +296,200 @@ try:
             elif is_camera:
                 attempt += 1
                 if attempt > 30:
-                    break
+                    return None
                 else:
                     time.sleep(0.02)
                     if attempt == 3:
                         need_reinit = 1
                     continue
             else:
-                break;
+                return None
 
         attempt = 0
         need_reinit = 0
+        return frame
+    return None
+
+def start_tracking(frame):
+    global first, height, width, sock, tracker, out
+    first = False
+    height, width, channels = frame.shape
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    tracker = Tracker(width, height, threshold=args.threshold, max_threads=args.max_threads, max_faces=args.faces, discard_after=args.discard_after, scan_every=args.scan_every, silent=False if args.silent == 0 else True, model_type=args.model, model_dir=args.model_dir, no_gaze=False if args.gaze_tracking != 0 and args.model != -1 else True, detection_threshold=args.detection_threshold, use_retinaface=args.scan_retinaface, max_feature_updates=args.max_feature_updates, static_model=True if args.no_3d_adapt == 1 else False, try_hard=args.try_hard == 1, batch_inference=args.batch_inference == 1, motion_model=args.motion_model == 1, max_skip=args.max_skip, skip_motion=args.skip_motion, local_search=args.local_search == 1, idle_interval=args.idle_interval, idle_motion=args.idle_motion, focused_scan=args.focused_scan == 1, scan_motion=args.scan_motion, frame_budget=args.frame_budget)
+    if args.video_out is not None:
+        out = cv2.VideoWriter(args.video_out, cv2.VideoWriter_fourcc('F','F','V','1'), args.video_fps, (width * args.video_scale, height * args.video_scale))
+
+def track_frame(frame):
+    global total_tracking_time, tracking_time, tracking_frames
+    inference_start = time.perf_counter()
+    assert tracker is not None, "Tracker should be initialized"
+    faces = tracker.predict(frame)
+    if len(faces) > 0:
+        inference_time = (time.perf_counter() - inference_start)
+        total_tracking_time += inference_time
+        tracking_time += inference_time / len(faces)
+        tracking_frames += 1
+    if metrics_exporter is not None:
+        metrics_exporter.export(tracker.metrics)
+    return faces
+
+def output_frame(frame, faces, now, frame_count):
+    # Sends, logs and visualizes the tracking results for one frame, returns False when quitting was requested
+    packet_writer.reserve(len(faces))
+    detected = False
+    for face_num, f in enumerate(faces):
+        f = copy.copy(f)
+        f.id += args.face_id_offset
+        if f.eye_blink is None:
+            f.eye_blink = [1, 1]
+        right_state = "O" if f.eye_blink[0] > 0.30 else "-"
+        left_state = "O" if f.eye_blink[1] > 0.30 else "-"
+        if args.silent == 0:
+            print(f"Confidence[{f.id}]: {f.conf:.4f} / 3D fitting error: {f.pnp_error:.4f} / Eyes: {left_state}, {right_state}")
+        detected = True
+        if f.current_features is None:
+            f.current_features = {}
+        for feature in features:
+            if not feature in f.current_features:
+                f.current_features[feature] = 0
+        packet_writer.write(face_num, f, now, width, height)
+        if vmc_sender is not None:
+            vmc_sender.send_tracking_data(f)
+        if log is not None:
+            log.write_face(frame_count, now, width, height, fps, face_num, f)
+        if args.visualize > 1:
+            frame = cv2.putText(frame, str(f.id), (int(f.bbox[0]), int(f.bbox[1])), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255,0,255))
+        if args.visualize > 2:
+            frame = cv2.putText(frame, f"{f.conf:.4f}", (int(f.bbox[0] + 18), int(f.bbox[1] - 6)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,255))
+        for pt_num, (x,y,c) in enumerate(f.lms):
+            if pt_num == 66 and (f.eye_blink[0] < 0.30 or c < 0.20):
+                continue
+            if pt_num == 67 and (f.eye_blink[1] < 0.30 or c < 0.20):
+                continue
+            x = int(x + 0.5)
+            y = int(y + 0.5)
+            if args.visualize != 0 or out is not None:
+                if args.visualize > 3:
+                    frame = cv2.putText(frame, str(pt_num), (int(y), int(x)), cv2.FONT_HERSHEY_SIMPLEX, 0.25, (255,255,0))
+                color = (0, 255, 0)
+                if pt_num >= 66:
+                    color = (255, 255, 0)
+                if not (x < 0 or y < 0 or x >= height or y >= width):
+                    cv2.circle(frame, (y, x), 1, color, -1)
+        if args.pnp_points != 0 and (args.visualize != 0 or out is not None) and f.rotation is not None:
+            if args.pnp_points > 1:
+                projected = cv2.projectPoints(f.face_3d[0:66], f.rotation, f.translation, tracker.camera, tracker.dist_coeffs)
+            else:
+                projected = cv2.projectPoints(f.contour, f.rotation, f.translation, tracker.camera, tracker.dist_coeffs)
+            for [(x,y)] in projected[0]:
+                x = int(x + 0.5)
+                y = int(y + 0.5)
+                if not (x < 0 or y < 0 or x >= height or y >= width):
+                    frame[int(x), int(y)] = (0, 255, 255)
+                x += 1
+                if not (x < 0 or y < 0 or x >= height or y >= width):
+                    frame[int(x), int(y)] = (0, 255, 255)
+                y += 1
+                if not (x < 0 or y < 0 or x >= height or y >= width):
+                    frame[int(x), int(y)] = (0, 255, 255)
+                x -= 1
+                if not (x < 0 or y < 0 or x >= height or y >= width):
+                    frame[int(x), int(y)] = (0, 255, 255)
+
+    if detected and len(faces) < 40:
+        assert sock is not None, "Socket should be initialized"
+        packet = packet_writer.packet(len(faces))
+        for target in targets:
+            sock.sendto(packet, target)
+
+    if out is not None:
+        video_frame = frame
+        if args.video_scale != 1:
+            video_frame = cv2.resize(frame, (width * args.video_scale, height * args.video_scale), interpolation=cv2.INTER_NEAREST)
+        out.write(video_frame)
+        if args.video_scale != 1:
+            del video_frame
+
+    if args.visualize != 0:
+        cv2.imshow('OpenSeeFace Visualization', frame)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            if args.dump_points != "" and faces is not None and len(faces) > 0:
+                np.set_printoptions(threshold=sys.maxsize, precision=15)
+                pairs = [
+                    (0, 16),
+                    (1, 15),
+                    (2, 14),
+                    (3, 13),
+                    (4, 12),
+                    (5, 11),
+                    (6, 10),
+                    (7, 9),
+                    (17, 26),
+                    (18, 25),
+                    (19, 24),
+                    (20, 23),
+                    (21, 22),
+                    (31, 35),
+                    (32, 34),
+                    (36, 45),
+                    (37, 44),
+                    (38, 43),
+                    (39, 42),
+                    (40, 47),
+                    (41, 46),
+                    (48, 52),
+                    (49, 51),
+                    (56, 54),
+                    (57, 53),
+                    (58, 62),
+                    (59, 61),
+                    (65, 63)
+                ]
+                points = copy.copy(faces[0].face_3d)
+                for a, b in pairs:
+                    x = (points[a, 0] - points[b, 0]) / 2.0
+                    y = (points[a, 1] + points[b, 1]) / 2.0
+                    z = (points[a, 2] + points[b, 2]) / 2.0
+                    points[a, 0] = x
+                    points[b, 0] = -x
+                    points[[a, b], 1] = y
+                    points[[a, b], 2] = z
+                points[[8, 27, 28, 29, 33, 50, 55, 60, 64], 0] = 0.0
+                points[30, :] = 0.0
+                with open(args.dump_points, "w") as fh:
+                    fh.write(repr(points))
+            return False
+    return True
+
+def track_failed():
+    global failures
+    traceback.print_exc()
+    failures += 1
+    return failures > 30
+
+def run_serial():
+    global frame_count, failures, frame_time
+    while True:
+        frame = read_frame()
+        if frame is None:
+            break
         frame_count += 1
-        now = time.time()
+        now = input_reader.frame_time()
 
         if first:
-            first = False
-            height, width, channels = frame.shape
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            tracker = Tracker(width, height, threshold=args.threshold, max_threads=args.max_threads, max_faces=args.faces, discard_after=args.discard_after, scan_every=args.scan_every, silent=False if args.silent == 0 else True, model_type=args.model, model_dir=args.model_dir, no_gaze=False if args.gaze_tracking != 0 and args.model != -1 else True, detection_threshold=args.detection_threshold, use_retinaface=args.scan_retinaface, max_feature_updates=args.max_feature_updates, static_model=True if args.no_3d_adapt == 1 else False, try_hard=args.try_hard == 1)
-            if args.video_out is not None:
-                out = cv2.VideoWriter(args.video_out, cv2.VideoWriter_fourcc('F','F','V','1'), args.video_fps, (width * args.video_scale, height * args.video_scale))
+            start_tracking(frame)
 
         try:
-            inference_start = time.perf_counter()
-            assert tracker is not None, "Tracker should be initialized"
-            faces = tracker.predict(frame)
-            if len(faces) > 0:
-                inference_time = (time.perf_counter() - inference_start)
-                total_tracking_time += inference_time
-                tracking_time += inference_time / len(faces)
-                tracking_frames += 1
-            packet = bytearray()
-            detected = False
-            for face_num, f in enumerate(faces):
-                f = copy.copy(f)
-                f.id += args.face_id_offset
-                if f.eye_blink is None:
-                    f.eye_blink = [1, 1]
-                right_state = "O" if f.eye_blink[0] > 0.30 else "-"
-                left_state = "O" if f.eye_blink[1] > 0.30 else "-"
-                if args.silent == 0:
-                    print(f"Confidence[{f.id}]: {f.conf:.4f} / 3D fitting error: {f.pnp_error:.4f} / Eyes: {left_state}, {right_state}")
-                detected = True
-                if not f.success:
-                    pts_3d = np.zeros((70, 3), np.float32)
-                packet.extend(bytearray(struct.pack("d", now)))
-                packet.extend(bytearray(struct.pack("i", f.id)))
-                packet.extend(bytearray(struct.pack("f", width)))
-                packet.extend(bytearray(struct.pack("f", height)))
-                packet.extend(bytearray(struct.pack("f", f.eye_blink[0])))
-                packet.extend(bytearray(struct.pack("f", f.eye_blink[1])))
-                packet.extend(bytearray(struct.pack("B", 1 if f.success else 0)))
-                packet.extend(bytearray(struct.pack("f", f.pnp_error)))
-                packet.extend(bytearray(struct.pack("f", f.quaternion[0])))
-                packet.extend(bytearray(struct.pack("f", f.quaternion[1])))
-                packet.extend(bytearray(struct.pack("f", f.quaternion[2])))
-                packet.extend(bytearray(struct.pack("f", f.quaternion[3])))
-                packet.extend(bytearray(struct.pack("f", f.euler[0])))
-                packet.extend(bytearray(struct.pack("f", f.euler[1])))
-                packet.extend(bytearray(struct.pack("f", f.euler[2])))
-                packet.extend(bytearray(struct.pack("f", f.translation[0])))
-                packet.extend(bytearray(struct.pack("f", f.translation[1])))
-                packet.extend(bytearray(struct.pack("f", f.translation[2])))
-                if log is not None:
-                    log.write(f"{frame_count},{now},{width},{height},{fps},{face_num},{f.id},{f.eye_blink[0]},{f.eye_blink[1]},{f.conf},{f.success},{f.pnp_error},{f.quaternion[0]},{f.quaternion[1]},{f.quaternion[2]},{f.quaternion[3]},{f.euler[0]},{f.euler[1]},{f.euler[2]},{f.rotation[0]},{f.rotation[1]},{f.rotation[2]},{f.translation[0]},{f.translation[1]},{f.translation[2]}")
-                for (x,y,c) in f.lms:
-                    packet.extend(bytearray(struct.pack("f", c)))
-                if args.visualize > 1:
-                    frame = cv2.putText(frame, str(f.id), (int(f.bbox[0]), int(f.bbox[1])), cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255,0,255))
-                if args.visualize > 2:
-                    frame = cv2.putText(frame, f"{f.conf:.4f}", (int(f.bbox[0] + 18), int(f.bbox[1] - 6)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,255))
-                for pt_num, (x,y,c) in enumerate(f.lms):
-                    packet.extend(bytearray(struct.pack("f", y)))
-                    packet.extend(bytearray(struct.pack("f", x)))
-                    if log is not None:
-                        log.write(f",{y},{x},{c}")
-                    if pt_num == 66 and (f.eye_blink[0] < 0.30 or c < 0.20):
-                        continue
-                    if pt_num == 67 and (f.eye_blink[1] < 0.30 or c < 0.20):
-                        continue
-                    x = int(x + 0.5)
-                    y = int(y + 0.5)
-                    if args.visualize != 0 or out is not None:
-                        if args.visualize > 3:
-                            frame = cv2.putText(frame, str(pt_num), (int(y), int(x)), cv2.FONT_HERSHEY_SIMPLEX, 0.25, (255,255,0))
-                        color = (0, 255, 0)
-                        if pt_num >= 66:
-                            color = (255, 255, 0)
-                        if not (x < 0 or y < 0 or x >= height or y >= width):
-                            cv2.circle(frame, (y, x), 1, color, -1)
-                if args.pnp_points != 0 and (args.visualize != 0 or out is not None) and f.rotation is not None:
-                    if args.pnp_points > 1:
-                        projected = cv2.projectPoints(f.face_3d[0:66], f.rotation, f.translation, tracker.camera, tracker.dist_coeffs)
-                    else:
-                        projected = cv2.projectPoints(f.contour, f.rotation, f.translation, tracker.camera, tracker.dist_coeffs)
-                    for [(x,y)] in projected[0]:
-                        x = int(x + 0.5)
-                        y = int(y + 0.5)
-                        if not (x < 0 or y < 0 or x >= height or y >= width):
-                            frame[int(x), int(y)] = (0, 255, 255)
-                        x += 1
-                        if not (x < 0 or y < 0 or x >= height or y >= width):
-                            frame[int(x), int(y)] = (0, 255, 255)
-                        y += 1
-                        if not (x < 0 or y < 0 or x >= height or y >= width):
-                            frame[int(x), int(y)] = (0, 255, 255)
-                        x -= 1
-                        if not (x < 0 or y < 0 or x >= height or y >= width):
-                            frame[int(x), int(y)] = (0, 255, 255)
-                for (x,y,z) in f.pts_3d:
-                    packet.extend(bytearray(struct.pack("f", x)))
-                    packet.extend(bytearray(struct.pack("f", -y)))
-                    packet.extend(bytearray(struct.pack("f", -z)))
-                    if log is not None:
-                        log.write(f",{x},{-y},{-z}")
-                if f.current_features is None:
-                    f.current_features = {}
-                for feature in features:
-                    if not feature in f.current_features:
-                        f.current_features[feature] = 0
-                    packet.extend(bytearray(struct.pack("f", f.current_features[feature])))
-                    if log is not None:
-                        log.write(f",{f.current_features[feature]}")
-                if log is not None:
-                    log.write("\r\n")
-                    log.flush()
-
-            if detected and len(faces) < 40:
-                assert sock is not None, "Socket should be initialized"
-                sock.sendto(packet, (target_ip, target_port))
-
-            if out is not None:
-                video_frame = frame
-                if args.video_scale != 1:
-                    video_frame = cv2.resize(frame, (width * args.video_scale, height * args.video_scale), interpolation=cv2.INTER_NEAREST)
-                out.write(video_frame)
-                if args.video_scale != 1:
-                    del video_frame
-
-            if args.visualize != 0:
-                cv2.imshow('OpenSeeFace Visualization', frame)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    if args.dump_points != "" and faces is not None and len(faces) > 0:
-                        np.set_printoptions(threshold=sys.maxsize, precision=15)
-                        pairs = [
-                            (0, 16),
-                            (1, 15),
-                            (2, 14),
-                            (3, 13),
-                            (4, 12),
-                            (5, 11),
-                            (6, 10),
-                            (7, 9),
-                            (17, 26),
-                            (18, 25),
-                            (19, 24),
-                            (20, 23),
-                            (21, 22),
-                            (31, 35),
-                            (32, 34),
-                            (36, 45),
-                            (37, 44),
-                            (38, 43),
-                            (39, 42),
-                            (40, 47),
-                            (41, 46),
-                            (48, 52),
-                            (49, 51),
-                            (56, 54),
-                            (57, 53),
-                            (58, 62),
-                            (59, 61),
-                            (65, 63)
-                        ]
-                        points = copy.copy(faces[0].face_3d)
-                        for a, b in pairs:
-                            x = (points[a, 0] - points[b, 0]) / 2.0
-                            y = (points[a, 1] + points[b, 1]) / 2.0
-                            z = (points[a, 2] + points[b, 2]) / 2.0
-                            points[a, 0] = x
-                            points[b, 0] = -x
-                            points[[a, b], 1] = y
-                            points[[a, b], 2] = z
-                        points[[8, 27, 28, 29, 33, 50, 55, 60, 64], 0] = 0.0
-                        points[30, :] = 0.0
-                        with open(args.dump_points, "w") as fh:
-                            fh.write(repr(points))
-                    break
+            faces = track_frame(frame)
+            if not output_frame(frame, faces, now, frame_count):
+                break
             failures = 0
         except Exception as e:
             if e.__class__ == KeyboardInterrupt:
                 if args.silent == 0:
                     print("Quitting")
                 break
-            traceback.print_exc()
-            failures += 1
-            if failures > 30:
+            if track_failed():
                 break
 
         collected = False
@@ -446,11 +506,111 @@ try:
                 time.sleep(sleep_time)
             duration = time.perf_counter() - frame_time
         frame_time = time.perf_counter()
+
+def capture_stage(item):
+    global frame_count, frame_time
+    frame = read_frame()
+    if frame is None:
+        return END
+    frame_count += 1
+    now = input_reader.frame_time()
+    duration = time.perf_counter() - frame_time
+    if duration < target_duration:
+        time.sleep(target_duration - duration)
+    frame_time = time.perf_counter()
+    return (frame_count, now, frame)
+
+def snapshot_face(f):
+    # The tracker keeps updating its face objects while the output stage works, so it gets a copy with its own pose
+    f = copy.copy(f)
+    # The rotation is None after the 3D fit of a face was reset
+    f.rotation = None if f.rotation is None else np.array(f.rotation)
+    f.translation = None if f.translation is None else np.array(f.translation)
+    return f
+
+def track_stage(item):
+    global failures
+    frame_num, now, frame = item
+    if first:
+        start_tracking(frame)
+    try:
+        faces = [snapshot_face(f) for f in track_frame(frame)]
+        failures = 0
+    except Exception:
+        if track_failed():
+            return END
+        return None
+    return (frame_num, now, frame, faces)
+
+def run_pipelined():
+    # Capture and tracking run in their own threads, output and visualization stay on the main thread
+    stop = threading.Event()
+    drop = type(input_reader.reader) != VideoReader
+    frames = queue.Queue(maxsize=max(args.pipeline_depth, 1))
+    tracked = queue.Queue(maxsize=max(args.pipeline_depth, 1))
+    capture = Stage("capture", capture_stage, None, frames, stop, drop=drop)
+    tracking = Stage("tracking", track_stage, frames, tracked, stop, drop=drop)
+    capture.start()
+    tracking.start()
+    try:
+        while True:
+            try:
+                item = tracked.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is END:
+                break
+            frame_num, now, frame, faces = item
+            try:
+                if not output_frame(frame, faces, now, frame_num):
+                    break
+            except Exception:
+                traceback.print_exc()
+    finally:
+        stop.set()
+        capture.join(1.0)
+        tracking.join(1.0)
+    if args.silent == 0 and (capture.dropped > 0 or tracking.dropped > 0):
+        print(f"Dropped frames: {capture.dropped} before tracking, {tracking.dropped} before output")
+
+def run_replay():
+    # Sends the faces of a recorded tracking data log instead of tracking an input
+    global first, width, height, sock, frame_count
+    source = ReplaySource(args.replay, speed=args.replay_speed, copies=args.replay_copies, repeat=args.repeat_video != 0)
+    first = False
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    start = time.perf_counter()
+    try:
+        for frame_num, width, height, faces in source:
+            frame_count += 1
+            if not output_frame(None, faces, time.time(), frame_count):
+                break
+    finally:
+        duration = time.perf_counter() - start
+        if args.silent == 0 and duration > 0:
+            print(f"Replayed {source.frames_sent} frames with {source.faces_sent} faces in {duration:.3f} s ({source.frames_sent / duration:.1f} frames/s, {source.faces_sent / duration:.1f} faces/s)")
+
+try:
+    if args.replay != "":
+        run_replay()
+    elif args.pipeline != 0:
+        run_pipelined()
+    else:
+        run_serial()
 except KeyboardInterrupt:
     if args.silent == 0:
         print("Quitting")
 
-input_reader.close()
+if input_reader is not None:
+    input_reader.close()
+if log is not None:
+    log.close()
+if tracker is not None:
+    tracker.close()
+    if metrics_exporter is not None:
+        metrics_exporter.export(tracker.metrics, force=True)
+if metrics_exporter is not None:
+    metrics_exporter.close()
 if out is not None:
     out.release()
 if args.visualize != 0:
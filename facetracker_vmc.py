@@ -27,6 +27,7 @@
 #         -F, --fps        Frames per second (default: 24)
 #         --model          Tracking model quality 0-3 (default: 3)
 #         -v, --visualize  Show tracking visualization
+#         --replay         Send a recorded tracking data log instead of tracking
 #
 # Example for Warudo:
 #     python facetracker_vmc.py -c 0 --vmc-port 39539 --model 3
@@ -34,6 +35,9 @@
 # Example for VMagicMirror:
 #     python facetracker_vmc.py -c 0 --vmc-port 39540 --model 3
 #
+# Example for load-testing a receiver with a log recorded by facetracker.py:
+#     python facetracker_vmc.py --replay tracking.csv --replay-speed 0
+#
 # Author: OpenSeeFace Contributors
 # License: BSD 2-clause
 # =============================================================================
@@ -49,10 +53,13 @@ import numpy as np
 from input_reader import InputReader, VideoReader, try_int
 from tracker import Tracker, get_model_base_path
 from vmc_sender import VMCSender
+from replay import ReplaySource
 
 parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 parser.add_argument("--vmc-ip", help="Set IP address for sending VMC data", default="127.0.0.1")
 parser.add_argument("--vmc-port", type=int, help="Set port for sending VMC data", default=39539)
+parser.add_argument("--vmc-epsilon", type=float, help="Only send blend shape values that changed by more than this", default=0.005)
+parser.add_argument("--vmc-keyframe-interval", type=float, help="Seconds after which all blend shape values are sent again, 0 sends all of them every frame", default=1.0)
 parser.add_argument("-W", "--width", type=int, help="Set camera width", default=640)
 parser.add_argument("-H", "--height", type=int, help="Set camera height", default=480)
 parser.add_argument("-F", "--fps", type=int, help="Set camera frames per second", default=24)
@@ -67,11 +74,26 @@ parser.add_argument("--model", type=int, help="Tracking model (higher = better q
 parser.add_argument("--model-dir", help="Path to the directory containing the .onnx model files", default=None)
 parser.add_argument("--gaze-tracking", type=int, help="When set to 1, gaze tracking is enabled", default=1)
 parser.add_argument("--faces", type=int, help="Set the maximum number of faces", default=1)
+parser.add_argument("--batch-inference", type=int, help="When set to 1, all face crops of a frame are run through the landmark model as one batch", default=0)
+parser.add_argument("--motion-model", type=int, help="When set to 1, face crops follow the predicted movement of each face", default=0)
+parser.add_argument("--max-skip", type=int, help="Skip the landmark model for up to this many frames in a row while faces hold still", default=0)
+parser.add_argument("--skip-motion", type=float, help="Movement relative to the face size that makes the landmark model run again", default=0.01)
+parser.add_argument("--local-search", type=int, help="When set to 1, lost faces are searched for around their last position before searching the whole frame", default=0)
+parser.add_argument("--idle-interval", type=int, help="Back off face detection up to this many frames while no face is found", default=0)
+parser.add_argument("--idle-motion", type=float, help="Mean gray level change that makes face detection run right away while backing off", default=0.0)
+parser.add_argument("--focused-scan", type=int, help="When set to 1, scans for more faces skip tracked faces and only search changed regions", default=0)
+parser.add_argument("--scan-motion", type=float, help="Gray level difference that counts as a change for --focused-scan", default=12.0)
+parser.add_argument("--frame-budget", type=float, help="Milliseconds per frame that scans for more faces have to fit into, 0 always uses --scan-every", default=0.0)
 parser.add_argument("--scan-every", type=int, help="Set after how many frames a scan for new faces should run", default=3)
 parser.add_argument("--discard-after", type=int, help="Set how long the tracker should keep looking for lost faces", default=10)
 parser.add_argument("--max-feature-updates", type=int, help="Seconds after which feature values stop updating", default=900)
 parser.add_argument("--no-3d-adapt", type=int, help="When set to 1, the 3D face model will not be adapted", default=1)
 parser.add_argument("--try-hard", type=int, help="When set to 1, the tracker will try harder to find a face", default=0)
+parser.add_argument("--threaded-capture", type=int, help="When set to 1, cameras are read in a background thread that keeps only the newest frame", default=0)
+parser.add_argument("--replay", type=str, help="Set this to the filename of a CSV or binary tracking data log to send the logged faces instead of tracking an input", default="")
+parser.add_argument("--replay-speed", type=float, help="Playback speed of a replayed log relative to its logged timestamps, 0 sends frames as fast as possible", default=1.0)
+parser.add_argument("--replay-copies", type=int, help="How many times every replayed face is sent under different face ids", default=1)
+parser.add_argument("--repeat-video", type=int, help="When set to 1, a replayed log starts over when it ends", default=0)
 
 if sys.platform == 'linux':
     parser.add_argument("--dformat", type=str, help="Set device format (MJPG, YUYV, RGB3, ...)", default=None)
@@ -81,17 +103,24 @@ args = parser.parse_args()
 os.environ["OMP_NUM_THREADS"] = str(args.max_threads)
 
 # Initialize VMC sender
-vmc_sender = VMCSender(args.vmc_ip, args.vmc_port)
+vmc_sender = VMCSender(args.vmc_ip, args.vmc_port, blend_epsilon=args.vmc_epsilon, keyframe_interval=args.vmc_keyframe_interval)
 print(f"VMC Protocol sender initialized: {args.vmc_ip}:{args.vmc_port}")
 
 # Initialize input reader
 fps = args.fps
-if sys.platform == 'linux' and hasattr(args, 'dformat') and args.dformat:
-    input_reader = InputReader(args.capture, 0, args.width, args.height, fps, dcap=args.dformat)
+input_reader = None
+if args.replay != "":
+    # Replayed faces come from the log, there is no input to read
+    fps = 0
+    if args.visualize != 0:
+        print("Visualization is not available when replaying a tracking data log.")
+        args.visualize = 0
+elif sys.platform == 'linux' and hasattr(args, 'dformat') and args.dformat:
+    input_reader = InputReader(args.capture, 0, args.width, args.height, fps, dcap=args.dformat, threaded=args.threaded_capture != 0)
 else:
-    input_reader = InputReader(args.capture, 0, args.width, args.height, fps)
+    input_reader = InputReader(args.capture, 0, args.width, args.height, fps, threaded=args.threaded_capture != 0)
 
-if type(input_reader.reader) == VideoReader:
+if input_reader is not None and type(input_reader.reader) == VideoReader:
     fps = 0
 
 first = True
@@ -102,11 +131,26 @@ frame_count = 0
 
 is_camera = args.capture == str(try_int(args.capture))
 
+def run_replay():
+    # Sends the faces of a recorded tracking data log instead of tracking an input
+    source = ReplaySource(args.replay, speed=args.replay_speed, copies=args.replay_copies, repeat=args.repeat_video != 0)
+    start = time.perf_counter()
+    try:
+        for frame_num, width, height, faces in source:
+            for f in faces:
+                vmc_sender.send_tracking_data(f)
+    finally:
+        duration = time.perf_counter() - start
+        if duration > 0:
+            print(f"Replayed {source.frames_sent} frames with {source.faces_sent} faces in {duration:.3f} s ({source.frames_sent / duration:.1f} frames/s, {source.faces_sent / duration:.1f} faces/s)")
+
 print("Starting VMC face tracking...")
 print("Press Ctrl+C to stop")
 
 try:
-    while input_reader.is_open():
+    if args.replay != "":
+        run_replay()
+    while input_reader is not None and input_reader.is_open():
         if not input_reader.is_ready():
             time.sleep(0.001)
             continue
@@ -142,7 +186,17 @@ try:
                 use_retinaface=False,
                 max_feature_updates=args.max_feature_updates,
                 static_model=True if args.no_3d_adapt == 1 else False,
-                try_hard=args.try_hard == 1
+                try_hard=args.try_hard == 1,
+                batch_inference=args.batch_inference == 1,
+                motion_model=args.motion_model == 1,
+                max_skip=args.max_skip,
+                skip_motion=args.skip_motion,
+                local_search=args.local_search == 1,
+                idle_interval=args.idle_interval,
+                idle_motion=args.idle_motion,
+                focused_scan=args.focused_scan == 1,
+                scan_motion=args.scan_motion,
+                frame_budget=args.frame_budget
             )
             print(f"Tracker initialized: {width}x{height}")
 
@@ -179,7 +233,10 @@ try:
 except KeyboardInterrupt:
     print("\nStopping...")
 finally:
-    input_reader.close()
+    if input_reader is not None:
+        input_reader.close()
+    if tracker is not None:
+        tracker.close()
     if args.visualize != 0:
         cv2.destroyAllWindows()
     print("VMC face tracking stopped")
@@ -31,7 +31,6 @@
 #     - opencv-python
 #     - pillow
 #     - All OpenSeeFace dependencies (onnxruntime, numpy)
-#     - python-osc (for VMC protocol support)
 #
 # Author: OpenSeeFace Contributors
 # License: BSD 2-clause
@@ -5,7 +5,9 @@ import cv2
 import numpy as np
 import escapi
 import dshowcapture
+from shm_frames import SharedFrameReader
 import time
+import threading
 import traceback
 import gc
 
@@ -101,8 +103,57 @@ class DShowCaptureReader(VideoReader):
     def close(self):
         self.device.destroy_capture()
 
+class FrameGrabber(threading.Thread):
+    # Reads frames from a capture in the background, keeping only the newest one
+    def __init__(self, cap):
+        super().__init__(name="frame grabber", daemon=True)
+        self.cap = cap
+        self.condition = threading.Condition()
+        self.frame = None
+        self.frame_time = 0.0
+        self.seq = 0
+        self.read_seq = 0
+        self.time = 0.0
+        self.dropped = 0
+        self.running = True
+        self.start()
+    def run(self):
+        while self.running:
+            ret = self.cap.grab()
+            # Taken before decoding, as close to the capture as possible
+            now = time.time()
+            frame = None
+            if ret:
+                ret, frame = self.cap.retrieve()
+            with self.condition:
+                # A failed read is passed on as a frame of None, so the reader notices it
+                self.frame = frame if ret else None
+                self.frame_time = now
+                self.seq += 1
+                self.condition.notify_all()
+            if not ret:
+                time.sleep(0.01)
+    def is_ready(self, timeout=0.02):
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq != self.read_seq or not self.running, timeout)
+            return self.seq != self.read_seq
+    def read(self):
+        with self.condition:
+            if self.seq == self.read_seq:
+                return False, None
+            self.dropped += self.seq - self.read_seq - 1
+            self.read_seq = self.seq
+            self.time = self.frame_time
+            frame = self.frame
+        return frame is not None, frame
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.join(1.0)
+
 class OpenCVReader(VideoReader):
-    def __init__(self, capture, width, height, fps):
+    def __init__(self, capture, width, height, fps, threaded=False):
         self.device = None
         self.width = width
         self.height = height
@@ -112,17 +163,26 @@ class OpenCVReader(VideoReader):
         self.cap.set(3, width)
         self.cap.set(4, height)
         self.cap.set(38, 1)
+        self.grabber = FrameGrabber(self.cap) if threaded else None
     def is_open(self):
         return super(OpenCVReader, self).is_open()
     def is_ready(self):
+        if self.grabber is not None:
+            return self.grabber.is_ready()
         return super(OpenCVReader, self).is_ready()
     def read(self):
+        if self.grabber is not None:
+            ret, frame = self.grabber.read()
+            self.time = self.grabber.time
+            return ret, frame
         return super(OpenCVReader, self).read()
     def close(self):
+        if self.grabber is not None:
+            self.grabber.stop()
         super(OpenCVReader, self).close()
 
 class V4L2Reader(OpenCVReader):
-    def __init__(self, capture, width, height, fps, dformat):
+    def __init__(self, capture, width, height, fps, dformat, threaded=False):
         self.cap = cv2.VideoCapture(capture, cv2.CAP_V4L2)
         if dformat:
             fourcc = cv2.VideoWriter.fourcc(*dformat)
@@ -136,6 +196,7 @@ class V4L2Reader(OpenCVReader):
         self.cap.set(4, height)
         self.cap.set(38, 1)
         self.cap.set(5, fps)
+        self.grabber = FrameGrabber(self.cap) if threaded else None
     def is_open(self):
         return super(V4L2Reader, self).is_open()
     def is_ready(self):
@@ -146,7 +207,7 @@ class V4L2Reader(OpenCVReader):
         super(V4L2Reader, self).close()
 
 class RawReader:
-    def __init__(self, width, height):
+    def __init__(self, width, height, path="", buffers=2):
         self.width = int(width)
         self.height = int(height)
         
@@ -155,21 +216,36 @@ class RawReader:
             sys.exit(0)
 
         self.len = self.width * self.height * 3
+        # Frames are read into these in turn, so the last ones stay valid while the next is read
+        self.buffers = [np.empty((self.height, self.width, 3), dtype=np.uint8) for i in range(max(buffers, 2))]
+        self.views = [memoryview(buffer).cast("B") for buffer in self.buffers]
+        self.index = 0
+        if path != "":
+            self.file = open(path, "rb", buffering=0)
+        else:
+            self.file = sys.stdin.buffer
         self.open = True
     def is_open(self):
         return self.open
     def is_ready(self):
         return True
     def read(self):
-        frame = bytearray()
+        view = self.views[self.index]
         read_bytes = 0
         while read_bytes < self.len:
-            bytes = sys.stdin.buffer.read(self.len)
-            read_bytes += len(bytes)
-            frame.extend(bytes)
-        return True, np.frombuffer(frame, dtype=np.uint8).reshape((self.height, self.width, 3))
+            count = self.file.readinto(view[read_bytes:])
+            if not count:
+                # End of input, an incomplete last frame is dropped
+                self.open = False
+                return False, None
+            read_bytes += count
+        frame = self.buffers[self.index]
+        self.index = (self.index + 1) % len(self.buffers)
+        return True, frame
     def close(self):
         self.open = False
+        if self.file is not sys.stdin.buffer:
+            self.file.close()
 
 def try_int(s):
     try:
@@ -202,12 +278,14 @@ def test_reader(reader):
         return False
 
 class InputReader():
-    def __init__(self, capture, raw_rgb, width, height, fps, use_dshowcapture=False, dcap=None):
+    def __init__(self, capture, raw_rgb, width, height, fps, use_dshowcapture=False, dcap=None, raw_path="", raw_shm="", hold=1, threaded=False):
         self.reader = None
         self.name = str(capture)
         try:
-            if raw_rgb > 0:
-                self.reader = RawReader(width, height)
+            if raw_shm != "":
+                self.reader = SharedFrameReader(raw_shm, hold=hold)
+            elif raw_rgb > 0:
+                self.reader = RawReader(width, height, path=raw_path, buffers=hold + 1)
             elif os.path.exists(capture):
                 self.reader = VideoReader(capture)
             elif capture == str(try_int(capture)):
@@ -254,18 +332,18 @@ class InputReader():
                         return
                     # Try with OpenCV
                     print(f"Escapi failed. Falling back to OpenCV. If this fails, please change your camera settings.", file=sys.stderr)
-                    self.reader = OpenCVReader(int(capture), width, height, fps)
+                    self.reader = OpenCVReader(int(capture), width, height, fps, threaded=threaded)
                     self.name = self.reader.name
                 elif sys.platform == 'linux':
                     try:
-                        self.reader = V4L2Reader(int(capture), width, height, fps, dcap)
+                        self.reader = V4L2Reader(int(capture), width, height, fps, dcap, threaded=threaded)
                     except:
                         print("V4L2 exception: ")
                         traceback.print_exc()
                         print(f"V4L2 failed. Falling back to OpenCV. If this fails, please change your camera settings.", file=sys.stderr)
-                        self.reader = OpenCVReader(int(capture), width, height, fps)
+                        self.reader = OpenCVReader(int(capture), width, height, fps, threaded=threaded)
                 else:
-                    self.reader = OpenCVReader(int(capture), width, height, fps)
+                    self.reader = OpenCVReader(int(capture), width, height, fps, threaded=threaded)
         except Exception as e:
             print("Error: " + str(e))
 
@@ -278,5 +356,8 @@ class InputReader():
         return self.reader.is_ready()
     def read(self):
         return self.reader.read()
+    def frame_time(self):
+        # Capture time of the last frame read, when the reader knows it
+        return getattr(self.reader, "time", None) or time.time()
     def close(self):
         self.reader.close()
@@ -0,0 +1,86 @@
+# =============================================================================
+# IO-Bound ONNX Runtime Sessions for OpenSeeFace
+# =============================================================================
+#
+# Wraps an onnxruntime.InferenceSession so that inputs and outputs are bound
+# to preallocated memory through IOBinding. Output arrays are allocated once
+# per batch size and kept bound, and input arrays stay bound for as long as
+# the caller keeps passing the same buffer, so running a model on every frame
+# no longer allocates fresh output tensors or copies the inputs.
+#
+# The arrays returned by run() are reused by the next call with the same
+# batch size. Copy anything that has to outlive that call.
+#
+# A binding is not thread-safe. Threads sharing one InferenceSession should
+# each create their own BoundSession for it.
+#
+# Usage:
+#     model = BoundSession(session)
+#     output = model.run({"input": buffer})[0]
+#
+# License: BSD 2-clause
+# =============================================================================
+
+import numpy as np
+import onnxruntime
+
+ORT_TYPES = {
+    "tensor(float)": np.float32,
+    "tensor(float16)": np.float16,
+    "tensor(double)": np.float64,
+    "tensor(int64)": np.int64,
+    "tensor(int32)": np.int32,
+    "tensor(uint8)": np.uint8,
+}
+
+
+class BoundSession():
+    def __init__(self, session):
+        self.session = session
+        self.binding = session.io_binding()
+        self.input_names = [input.name for input in session.get_inputs()]
+        self.output_specs = [(output.name, output.shape, ORT_TYPES[output.type]) for output in session.get_outputs()]
+        # Input name -> (data pointer, shape, array) currently bound
+        self.bound_inputs = {}
+        # Batch size -> preallocated output arrays and their OrtValues
+        self.outputs = {}
+        self.bound_batch = None
+
+    def output_shape(self, shape, batch):
+        # Dynamic dimensions of the models used here are all batch dimensions
+        return tuple(dim if isinstance(dim, int) else batch for dim in shape)
+
+    def bind_input(self, name, array):
+        if not array.flags.c_contiguous:
+            array = np.ascontiguousarray(array)
+        key = (array.ctypes.data, array.shape, array.dtype)
+        bound = self.bound_inputs.get(name)
+        if bound is not None and bound[0] == key:
+            return
+        self.binding.bind_ortvalue_input(name, onnxruntime.OrtValue.ortvalue_from_numpy(array))
+        # Keep the array alive while ONNX Runtime points at its memory
+        self.bound_inputs[name] = (key, array)
+
+    def bind_outputs(self, batch):
+        if self.bound_batch == batch:
+            return self.outputs[batch][0]
+        if batch not in self.outputs:
+            arrays = [np.zeros(self.output_shape(shape, batch), dtype) for _, shape, dtype in self.output_specs]
+            values = [onnxruntime.OrtValue.ortvalue_from_numpy(array) for array in arrays]
+            self.outputs[batch] = (arrays, values)
+        arrays, values = self.outputs[batch]
+        for (name, _, _), value in zip(self.output_specs, values):
+            self.binding.bind_ortvalue_output(name, value)
+        self.bound_batch = batch
+        return arrays
+
+    def run(self, feeds):
+        batch = 1
+        for name in self.input_names:
+            array = feeds[name]
+            self.bind_input(name, array)
+            if name == self.input_names[0]:
+                batch = array.shape[0]
+        outputs = self.bind_outputs(batch)
+        self.session.run_with_iobinding(self.binding)
+        return outputs
@@ -0,0 +1,208 @@
+# =============================================================================
+# Tracking Metrics for OpenSeeFace
+# =============================================================================
+#
+# Collects timing and tracking statistics from the face tracker so they can
+# be queried programmatically instead of parsed from console output.
+#
+# TrackerMetrics keeps the per-stage durations of the most recent frames in
+# a ring buffer, from which latency percentiles and histograms are computed
+# on demand. It also counts detection runs, rescans for additional faces,
+# local searches for lost faces and faces being found or lost, both in total
+# and per face slot, and keeps a short log of these events.
+#
+# MetricsExporter periodically writes snapshots of the metrics as JSON, one
+# object per line, to a file and/or as UDP datagrams to a local port.
+#
+# Usage:
+#     tracker = Tracker(width, height)
+#     ...
+#     stats = tracker.metrics.snapshot()
+#     print(stats["stages"]["track"]["p95"])
+#
+#     exporter = MetricsExporter(path="metrics.jsonl", port=11574)
+#     exporter.export(tracker.metrics)
+#
+# License: BSD 2-clause
+# =============================================================================
+
+import collections
+import json
+import socket
+import threading
+import time
+
+import numpy as np
+
+STAGES = ["detect", "crop", "track", "pnp", "total"]
+EVENTS = ["detect", "rescan", "search", "found", "lost"]
+
+# Default histogram bucket edges in milliseconds
+HISTOGRAM_EDGES = [0, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 75, 100, 150, 250, 500, 1000]
+
+
+class FaceCounters():
+    def __init__(self):
+        self.tracked_frames = 0
+        self.found = 0
+        self.lost = 0
+        self.pnp_failures = 0
+        self.last_conf = 0.0
+        self.last_seen = -1
+
+    def as_dict(self):
+        return {
+            "tracked_frames": self.tracked_frames,
+            "found": self.found,
+            "lost": self.lost,
+            "pnp_failures": self.pnp_failures,
+            "last_conf": self.last_conf,
+            "last_seen": self.last_seen,
+        }
+
+
+class TrackerMetrics():
+    def __init__(self, max_faces=1, history=1024, max_events=256):
+        self.lock = threading.Lock()
+        self.history = history
+        # Durations in milliseconds, one row per frame
+        self.timings = np.zeros((history, len(STAGES)), np.float32)
+        self.face_counts = np.zeros((history,), np.int32)
+        self.index = 0
+        self.frames = 0
+        self.frame_count = 0
+        self.counters = {event: 0 for event in EVENTS}
+        self.counters["crops"] = 0
+        self.faces = [FaceCounters() for i in range(max_faces)]
+        self.events = collections.deque(maxlen=max_events)
+        self.event_seq = 0
+
+    def record_frame(self, frame_count, detect, crop, track, pnp, total, faces, crops):
+        with self.lock:
+            row = self.timings[self.index]
+            row[0] = detect
+            row[1] = crop
+            row[2] = track
+            row[3] = pnp
+            row[4] = total
+            self.face_counts[self.index] = faces
+            self.index = (self.index + 1) % self.history
+            self.frames += 1
+            self.frame_count = frame_count
+            self.counters["crops"] += crops
+
+    def record_face(self, face_id, conf, success, frame_count):
+        with self.lock:
+            counters = self.faces[face_id]
+            counters.tracked_frames += 1
+            counters.last_conf = float(conf)
+            counters.last_seen = frame_count
+            if not success:
+                counters.pnp_failures += 1
+
+    def event(self, kind, frame_count, face_id=None):
+        with self.lock:
+            self.counters[kind] += 1
+            if face_id is not None:
+                if kind == "found":
+                    self.faces[face_id].found += 1
+                elif kind == "lost":
+                    self.faces[face_id].lost += 1
+            self.event_seq += 1
+            self.events.append((self.event_seq, frame_count, time.time(), kind, face_id))
+
+    def recent(self):
+        # Durations of the frames currently held in the ring buffer, oldest first
+        count = min(self.frames, self.history)
+        if self.frames <= self.history:
+            return self.timings[:count].copy(), self.face_counts[:count].copy()
+        order = np.roll(np.arange(self.history), -self.index)
+        return self.timings[order], self.face_counts[order]
+
+    def percentiles(self, stage, q=(50, 95, 99)):
+        with self.lock:
+            timings, _ = self.recent()
+        if timings.shape[0] == 0:
+            return [0.0 for p in q]
+        return [float(x) for x in np.percentile(timings[:, STAGES.index(stage)], q)]
+
+    def histogram(self, stage, edges=HISTOGRAM_EDGES):
+        # Bucket counts of the recent durations of a stage, the last bucket also holds everything above the top edge
+        with self.lock:
+            timings, _ = self.recent()
+        values = np.minimum(timings[:, STAGES.index(stage)], edges[-1])
+        counts, _ = np.histogram(values, bins=edges)
+        return counts.tolist(), list(edges)
+
+    def events_since(self, seq=0):
+        with self.lock:
+            return [event for event in self.events if event[0] > seq]
+
+    def snapshot(self, since=None):
+        with self.lock:
+            timings, face_counts = self.recent()
+            counters = dict(self.counters)
+            faces = {i: face.as_dict() for i, face in enumerate(self.faces)}
+            frames = self.frames
+            frame_count = self.frame_count
+            events = [event for event in self.events if since is None or event[0] > since]
+        stages = {}
+        for i, stage in enumerate(STAGES):
+            if timings.shape[0] == 0:
+                stages[stage] = {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+                continue
+            p50, p95, p99 = np.percentile(timings[:, i], (50, 95, 99))
+            stages[stage] = {"mean": float(timings[:, i].mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(timings[:, i].max())}
+        return {
+            "time": time.time(),
+            "frame": frame_count,
+            "frames": frames,
+            "window": int(timings.shape[0]),
+            "mean_faces": float(face_counts.mean()) if face_counts.shape[0] > 0 else 0.0,
+            "stages": stages,
+            "counters": counters,
+            "faces": faces,
+            "events": [{"seq": seq, "frame": frame, "time": t, "event": kind, "face": face_id} for seq, frame, t, kind, face_id in events],
+        }
+
+
+class MetricsExporter():
+    def __init__(self, path=None, port=None, host="127.0.0.1", interval=1.0):
+        self.fh = None
+        self.sock = None
+        self.address = None
+        if path:
+            self.fh = open(path, "a")
+        if port:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.address = (host, port)
+        self.interval = interval
+        self.last_export = 0.0
+        self.last_event = 0
+
+    def export(self, metrics, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last_export < self.interval:
+            return False
+        self.last_export = now
+        snapshot = metrics.snapshot(since=self.last_event)
+        if len(snapshot["events"]) > 0:
+            self.last_event = snapshot["events"][-1]["seq"]
+        line = json.dumps(snapshot)
+        if self.fh is not None:
+            self.fh.write(line + "\n")
+            self.fh.flush()
+        if self.sock is not None:
+            try:
+                self.sock.sendto(line.encode("utf-8"), self.address)
+            except OSError:
+                pass
+        return True
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
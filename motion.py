@@ -0,0 +1,85 @@
+# =============================================================================
+# Face Motion Model for OpenSeeFace
+# =============================================================================
+#
+# A constant velocity Kalman filter on the center and scale of a face's
+# bounding box. The tracker updates it with the box found by the landmark
+# model and uses its prediction for the next frame to place the crop for
+# that face, so faces moving quickly stay inside their crop.
+#
+# The state is the box center, its scale (the square root of its area) and
+# their velocities per frame. Noise is given relative to the scale, so the
+# filter behaves the same for near and far faces. The aspect ratio of the
+# box is not filtered but smoothed, since it hardly changes.
+#
+# predict() returns the predicted box widened by a number of standard
+# deviations of the predicted position and scale. While a face is tracked
+# steadily this margin stays small, after a miss or when the face starts to
+# move it grows.
+#
+# Usage:
+#     motion = BoxFilter()
+#     motion.update((x, y, w, h))
+#     x, y, w, h = motion.predict()
+#
+# License: BSD 2-clause
+# =============================================================================
+
+import numpy as np
+
+# State transition for one frame, position += velocity
+transition = np.eye(6)
+transition[0:3, 3:6] = np.eye(3)
+# Effect of an acceleration during one frame on position and velocity
+acceleration = np.concatenate([0.5 * np.eye(3), np.eye(3)])
+measurement = np.eye(3, 6)
+
+
+class BoxFilter():
+    def __init__(self, process_noise=0.02, measurement_noise=0.02, initial_velocity=0.05, margin=2.0, aspect_alpha=0.3):
+        # Noise values are standard deviations relative to the box scale
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.initial_velocity = initial_velocity
+        self.margin = margin
+        self.aspect_alpha = aspect_alpha
+        self.reset()
+
+    def reset(self):
+        self.initialized = False
+        self.state = np.zeros(6)
+        self.covariance = np.eye(6)
+        self.aspect = 1.0
+
+    def update(self, box):
+        x, y, w, h = box
+        w = max(float(w), 1.0)
+        h = max(float(h), 1.0)
+        z = np.array([x + w / 2.0, y + h / 2.0, np.sqrt(w * h)])
+        if not self.initialized:
+            self.initialized = True
+            self.aspect = h / w
+            self.state = np.concatenate([z, np.zeros(3)])
+            self.covariance = np.diag(np.concatenate([np.full(3, self.measurement_noise), np.full(3, self.initial_velocity)]) ** 2) * z[2] ** 2
+            return
+        self.aspect += self.aspect_alpha * (h / w - self.aspect)
+        noise = (self.measurement_noise * self.state[2]) ** 2 * np.eye(3)
+        residual = z - self.state[0:3]
+        innovation = self.covariance[0:3, 0:3] + noise
+        gain = self.covariance[:, 0:3] @ np.linalg.inv(innovation)
+        self.state = self.state + gain @ residual
+        self.covariance = (np.eye(6) - gain @ measurement) @ self.covariance
+
+    def predict(self):
+        # Advances the filter by one frame and returns the widened predicted box as (x, y, w, h)
+        noise = (self.process_noise * self.state[2]) ** 2 * (acceleration @ acceleration.T)
+        self.state = transition @ self.state
+        self.covariance = transition @ self.covariance @ transition.T + noise
+        cx, cy, scale = self.state[0:3]
+        scale = max(scale, 1.0)
+        self.state[2] = scale
+        sigma_x, sigma_y, sigma_scale = np.sqrt(np.diag(self.covariance)[0:3])
+        ratio = np.sqrt(self.aspect)
+        w = (scale + self.margin * sigma_scale) / ratio + 2 * self.margin * sigma_x
+        h = (scale + self.margin * sigma_scale) * ratio + 2 * self.margin * sigma_y
+        return (cx - w / 2.0, cy - h / 2.0, w, h)
@@ -0,0 +1,199 @@
+# =============================================================================
+# Offline Video Processing for OpenSeeFace
+# =============================================================================
+#
+# Tracks faces in a recorded video file as fast as possible using a pool of
+# worker processes and writes the same tracking data log as the
+# --log-data option of facetracker.py, as CSV or in the binary format.
+#
+# The video is split into chunks of consecutive frames, each tracked by its
+# own Tracker in a worker process. Tracking state such as face positions,
+# the adapted 3D model and the feature calibration builds up over time, so
+# every chunk first tracks a number of warm-up frames before its start
+# without logging them. Chunks are written to the log in order as soon as
+# they are done.
+#
+# Unlike a live log, the Time column holds the position of the frame in the
+# video in seconds and the FPS column holds the frame rate of the video.
+#
+# Usage:
+#     python offline.py -c recording.mp4 --log-data recording.csv -j 8
+#
+# License: BSD 2-clause
+# =============================================================================
+
+import argparse
+import multiprocessing
+import os
+import time
+import traceback
+
+import cv2
+import numpy as np
+
+from packet import features
+from tracking_log import TrackingLogWriter, csv_row, log_record, make_records, snapshot_face
+
+
+def count_frames(path):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Failed to open video file {path}")
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if frames <= 0:
+        # Some containers do not store the frame count
+        frames = 0
+        while cap.grab():
+            frames += 1
+    cap.release()
+    return frames, fps
+
+
+def open_at(path, index):
+    # Open a video positioned at the given frame, reading up to it when seeking is not exact
+    cap = cv2.VideoCapture(path)
+    if index > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != index:
+            cap.release()
+            cap = cv2.VideoCapture(path)
+            for i in range(index):
+                if not cap.grab():
+                    break
+    return cap
+
+
+def process_chunk(job):
+    # Tracks the frames [start, end) of the video, end is None for the last chunk, and returns the CSV rows or log records
+    settings, start, end = job
+    from tracker import Tracker
+    warmup_start = max(0, start - settings["warmup"])
+    cap = open_at(settings["capture"], warmup_start)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    tracker = None
+    rows = []
+    frames = 0
+    index = warmup_start
+    try:
+        while end is None or index < end:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if settings["mirror_input"]:
+                frame = cv2.flip(frame, 1)
+            height, width, _ = frame.shape
+            if tracker is None:
+                tracker = Tracker(width, height, **settings["tracker"])
+            faces = tracker.predict(frame)
+            if index >= start:
+                frames += 1
+                now = index / fps if fps > 0 else 0.0
+                for face_num, f in enumerate(faces):
+                    f = snapshot_face(f)
+                    f.id += settings["face_id_offset"]
+                    if f.eye_blink is None:
+                        f.eye_blink = [1, 1]
+                    f.current_features = dict(f.current_features) if f.current_features is not None else {}
+                    for feature in features:
+                        if not feature in f.current_features:
+                            f.current_features[feature] = 0
+                    # Formatted right away, so a face that cannot be logged only loses its own row
+                    row = (index + 1, now, width, height, fps, face_num, f)
+                    try:
+                        rows.append(make_records([row]) if settings["log_format"] == "binary" else csv_row(*row))
+                    except Exception:
+                        traceback.print_exc()
+            index += 1
+    finally:
+        cap.release()
+        if tracker is not None:
+            tracker.close()
+    if settings["log_format"] == "binary":
+        return start, frames, np.concatenate(rows) if len(rows) > 0 else np.zeros((0,), log_record)
+    return start, frames, "".join(rows)
+
+
+def run_offline(settings, log_path, processes=None, chunk_frames=1800, silent=False):
+    # The log format is taken from settings["log_format"]
+    if processes is None or processes < 1:
+        processes = os.cpu_count() or 1
+    total, fps = count_frames(settings["capture"])
+    chunk_frames = max(chunk_frames, 1)
+    starts = list(range(0, max(total, 1), chunk_frames))
+    jobs = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else None
+        jobs.append((settings, start, end))
+
+    start_time = time.perf_counter()
+    done = 0
+    log = TrackingLogWriter(log_path, format=settings["log_format"])
+    try:
+        with multiprocessing.Pool(min(processes, len(jobs))) as pool:
+            for start, frames, rows in pool.imap(process_chunk, jobs):
+                log.write_block(rows)
+                done += frames
+                if not silent:
+                    elapsed = time.perf_counter() - start_time
+                    print(f"Processed {done}/{total} frames ({done / elapsed:.1f} fps)")
+    finally:
+        log.close()
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-c", "--capture", help="Set the video file to process", required=True)
+    parser.add_argument("--log-data", help="Set the filename of the tracking data log to write", required=True)
+    parser.add_argument("--log-format", type=str, help="Set the format of the tracking data log, either csv or a compact binary format that can be converted to CSV with tracking_log.py", default="csv", choices=["csv", "binary"])
+    parser.add_argument("-j", "--processes", type=int, help="Set the number of worker processes, defaults to the number of CPU cores", default=None)
+    parser.add_argument("--chunk-frames", type=int, help="Set how many consecutive frames each worker process tracks at a time", default=1800)
+    parser.add_argument("--warmup-frames", type=int, help="Set how many frames before each chunk are tracked without being logged, so the tracking state can settle", default=90)
+    parser.add_argument("-m", "--max-threads", type=int, help="Set the maximum number of threads of each worker process", default=1)
+    parser.add_argument("-M", "--mirror-input", action="store_true", help="Process a mirror image of the input video")
+    parser.add_argument("-t", "--threshold", type=float, help="Set minimum confidence threshold for face tracking", default=None)
+    parser.add_argument("-d", "--detection-threshold", type=float, help="Set minimum confidence threshold for face detection", default=0.6)
+    parser.add_argument("-s", "--silent", type=int, help="Set this to 1 to prevent text output on the console", default=0)
+    parser.add_argument("--faces", type=int, help="Set the maximum number of faces (slow)", default=1)
+    parser.add_argument("--scan-retinaface", type=int, help="When set to 1, scanning for additional faces will be performed using RetinaFace in a background thread, otherwise a simpler, faster face detection mechanism is used. When the maximum number of faces is 1, this option does nothing.", default=0)
+    parser.add_argument("--batch-inference", type=int, help="When set to 1, the landmark model runs once on all face crops of a frame as a single batch instead of once per crop", default=0)
+    parser.add_argument("--motion-model", type=int, help="When set to 1, the crop for each face is placed at its position predicted by a Kalman filter", default=0)
+    parser.add_argument("--max-skip", type=int, help="When set above 0, the landmark model is skipped for up to this many frames in a row while the tracked faces hold still", default=0)
+    parser.add_argument("--skip-motion", type=float, help="Set how far, relative to the face size, a face may move before the landmark model runs again when --max-skip is used", default=0.01)
+    parser.add_argument("--local-search", type=int, help="When set to 1, lost faces are first searched for around their last position before searching the whole frame", default=0)
+    parser.add_argument("--idle-interval", type=int, help="When set above 1, face detection backs off exponentially up to this many frames while no face is found", default=0)
+    parser.add_argument("--idle-motion", type=float, help="When set above 0, a mean gray level change above this makes face detection run right away while backing off", default=0.0)
+    parser.add_argument("--focused-scan", type=int, help="When set to 1, scans for additional faces leave out the faces already tracked and only search regions of the image that changed since the last scan", default=0)
+    parser.add_argument("--scan-motion", type=float, help="Set the gray level difference at low resolution that counts as a change for --focused-scan", default=12.0)
+    parser.add_argument("--scan-every", type=int, help="Set after how many frames a scan for new faces should run", default=3)
+    parser.add_argument("--discard-after", type=int, help="Set the how long the tracker should keep looking for lost faces", default=10)
+    parser.add_argument("--max-feature-updates", type=int, help="This is the number of seconds after which feature min/max/medium values will no longer be updated once a face has been detected.", default=900)
+    parser.add_argument("--no-3d-adapt", type=int, help="When set to 1, the 3D face model will not be adapted to increase the fit", default=1)
+    parser.add_argument("--try-hard", type=int, help="When set to 1, the tracker will try harder to find a face", default=0)
+    parser.add_argument("--model", type=int, help="This can be used to select the tracking model. Higher numbers are models with better tracking quality, but slower speed.", default=3, choices=[-3, -2, -1, 0, 1, 2, 3, 4])
+    parser.add_argument("--model-dir", help="This can be used to specify the path to the directory containing the .onnx model files", default=None)
+    parser.add_argument("--gaze-tracking", type=int, help="When set to 1, gaze tracking is enabled, which makes things slightly slower", default=1)
+    parser.add_argument("--face-id-offset", type=int, help="When set, this offset is added to all face ids", default=0)
+    args = parser.parse_args()
+
+    # Worker processes inherit this, so each of them stays within its thread budget
+    os.environ["OMP_NUM_THREADS"] = str(args.max_threads)
+
+    settings = {
+        "capture": args.capture,
+        "log_format": args.log_format,
+        "warmup": max(args.warmup_frames, 0),
+        "mirror_input": args.mirror_input,
+        "face_id_offset": args.face_id_offset,
+        "tracker": dict(threshold=args.threshold, max_threads=args.max_threads, max_faces=args.faces, discard_after=args.discard_after, scan_every=args.scan_every, silent=True, model_type=args.model, model_dir=args.model_dir, no_gaze=False if args.gaze_tracking != 0 and args.model != -1 else True, detection_threshold=args.detection_threshold, use_retinaface=args.scan_retinaface, max_feature_updates=args.max_feature_updates, static_model=True if args.no_3d_adapt == 1 else False, try_hard=args.try_hard == 1, batch_inference=args.batch_inference == 1, motion_model=args.motion_model == 1, max_skip=args.max_skip, skip_motion=args.skip_motion, local_search=args.local_search == 1, idle_interval=args.idle_interval, idle_motion=args.idle_motion, focused_scan=args.focused_scan == 1, scan_motion=args.scan_motion),
+    }
+    start = time.perf_counter()
+    frames = run_offline(settings, args.log_data, processes=args.processes, chunk_frames=args.chunk_frames, silent=args.silent != 0)
+    if args.silent == 0:
+        print(f"Tracked {frames} frames in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
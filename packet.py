@@ -0,0 +1,101 @@
+# =============================================================================
+# Tracking Data Packets for OpenSeeFace
+# =============================================================================
+#
+# Serialization of tracked faces into the binary UDP packet format read by
+# the OpenSee Unity component and other receivers. A packet holds one
+# fixed-size record per face (packetFrameSize in OpenSee.cs), laid out
+# without padding as:
+#
+#     double  time
+#     int     face id
+#     float   width, height
+#     float   right eye open, left eye open
+#     byte    3D fit success
+#     float   PnP error
+#     float   rotation quaternion (x, y, z, w)
+#     float   euler angles (x, y, z)
+#     float   translation (x, y, z)
+#     float   68 landmark confidences
+#     float   68 landmarks (y, x)
+#     float   70 3D points (x, -y, -z)
+#     float   14 expression features, in the order of the features list
+#
+# All values are in native byte order. The records are described by the
+# packet_frame NumPy dtype and filled field by field into a preallocated
+# buffer, instead of packing every value separately.
+#
+# Usage:
+#     writer = PacketWriter(max_faces)
+#     sock.sendto(writer.pack(faces, now, width, height), (ip, port))
+#
+# License: BSD 2-clause
+# =============================================================================
+
+import numpy as np
+
+features = ["eye_l", "eye_r", "eyebrow_steepness_l", "eyebrow_updown_l", "eyebrow_quirk_l", "eyebrow_steepness_r", "eyebrow_updown_r", "eyebrow_quirk_r", "mouth_corner_updown_l", "mouth_corner_inout_l", "mouth_corner_updown_r", "mouth_corner_inout_r", "mouth_open", "mouth_wide"]
+
+packet_frame = np.dtype([
+    ("time", "=f8"),
+    ("id", "=i4"),
+    ("width", "=f4"),
+    ("height", "=f4"),
+    ("eye_blink", "=f4", (2,)),
+    ("success", "u1"),
+    ("pnp_error", "=f4"),
+    ("quaternion", "=f4", (4,)),
+    ("euler", "=f4", (3,)),
+    ("translation", "=f4", (3,)),
+    ("confidence", "=f4", (68,)),
+    ("landmarks", "=f4", (68, 2)),
+    ("points", "=f4", (70, 3)),
+    ("features", "=f4", (len(features),)),
+])
+packet_frame_size = packet_frame.itemsize
+
+# Converts 3D points into the receiver's coordinate system
+flip_yz = np.array([1, -1, -1], np.float32)
+
+
+class PacketWriter():
+    def __init__(self, max_faces=1):
+        self.buffer = np.zeros((0,), packet_frame)
+        self.reserve(max(max_faces, 1))
+
+    def reserve(self, faces):
+        if self.buffer.shape[0] >= faces:
+            return
+        self.buffer = np.zeros((faces,), packet_frame)
+        self.raw = self.buffer.view(np.uint8)
+        self.fields = {name: self.buffer[name] for name in packet_frame.names}
+
+    def write(self, index, f, now, width, height):
+        # Fill the record of one face, missing features are sent as 0 and missing eye blinks as open eyes
+        fields = self.fields
+        fields["time"][index] = now
+        fields["id"][index] = f.id
+        fields["width"][index] = width
+        fields["height"][index] = height
+        fields["eye_blink"][index] = f.eye_blink[0:2] if f.eye_blink is not None else (1, 1)
+        fields["success"][index] = 1 if f.success else 0
+        fields["pnp_error"][index] = f.pnp_error
+        fields["quaternion"][index] = f.quaternion[0:4]
+        fields["euler"][index] = f.euler[0:3]
+        fields["translation"][index] = f.translation[0:3]
+        lms = np.asarray(f.lms)
+        fields["confidence"][index] = lms[:, 2]
+        fields["landmarks"][index] = lms[:, 1::-1]
+        np.multiply(f.pts_3d, flip_yz, out=fields["points"][index])
+        current_features = f.current_features if f.current_features is not None else {}
+        fields["features"][index] = [current_features.get(feature, 0) for feature in features]
+
+    def packet(self, faces):
+        # The first records of the buffer as a bytes-like object, valid until the next write
+        return memoryview(self.raw[0:faces * packet_frame_size])
+
+    def pack(self, faces, now, width, height):
+        self.reserve(len(faces))
+        for i, f in enumerate(faces):
+            self.write(i, f, now, width, height)
+        return self.packet(len(faces))
@@ -0,0 +1,101 @@
+# =============================================================================
+# Pipelined Processing Stages for OpenSeeFace
+# =============================================================================
+#
+# Small helpers for running the capture, tracking and output steps of the
+# face tracker as separate threads connected by bounded queues. Each stage
+# pulls an item from its source queue, processes it and pushes the result
+# to its sink queue, so that e.g. decoding the next camera frame overlaps
+# with landmark inference on the current one.
+#
+# When a stage is created with drop=True, a full sink queue discards its
+# oldest entry instead of blocking, so slow downstream stages always work
+# on the most recent frame. Live sources should drop frames, while video
+# files should not.
+#
+# Usage:
+#     frames = queue.Queue(maxsize=2)
+#     stop = threading.Event()
+#     capture = Stage("capture", read_next, None, frames, stop, drop=True)
+#     capture.start()
+#
+# License: BSD 2-clause
+# =============================================================================
+
+import queue
+import threading
+import traceback
+
+# Sentinel passed downstream once a stage has finished
+END = object()
+
+
+def put_latest(q, item):
+    # Put an item into a bounded queue, discarding the oldest entries while it is full
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class Stage(threading.Thread):
+    def __init__(self, name, fn, source, sink, stop, drop=True, timeout=0.1):
+        # fn is called with each item taken from source, or with None when
+        # there is no source. It returns the item to pass on, None to pass
+        # nothing on or END to finish the stage.
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.source = source
+        self.sink = sink
+        self.stop = stop
+        self.drop = drop
+        self.timeout = timeout
+        self.dropped = 0
+        self.processed = 0
+
+    def put(self, item):
+        if self.drop and item is not END:
+            self.dropped += put_latest(self.sink, item)
+            return
+        while not self.stop.is_set():
+            try:
+                self.sink.put(item, timeout=self.timeout)
+                return
+            except queue.Full:
+                if item is END:
+                    # Make room so the end of the stream is never lost
+                    try:
+                        self.sink.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                item = None
+                if self.source is not None:
+                    try:
+                        item = self.source.get(timeout=self.timeout)
+                    except queue.Empty:
+                        continue
+                    if item is END:
+                        break
+                result = self.fn(item)
+                if result is END:
+                    break
+                if result is not None:
+                    self.processed += 1
+                    self.put(result)
+        except SystemExit:
+            pass
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            self.put(END)
@@ -40,6 +40,8 @@ _____
 
 """
 
+import numpy as np
+
 # If `ordered` is `False`, do not sort `lst`
 def median(lst,ordered=False):
   assert lst,"median needs a non-empty list"
@@ -80,3 +82,102 @@ class remedian:
     if i._median == None:
       i._median = median(all,ordered=False)
     return i._median
+
+# Array-backed variant for watching many streams at once, e.g. all
+# expression features of a face. Every stream gets the same `levels`
+# preallocated buffers of `k` items, so adding samples does not grow any
+# lists. Streams can be updated selectively by passing a boolean mask.
+#
+# While all streams receive every sample, they share their fill counts and
+# adding is a plain slice assignment. The first masked update switches to
+# per-stream bookkeeping.
+#
+# Medians match `remedian` exactly, including the rule that the median is
+# taken from the deepest level holding any numbers. Once the deepest
+# preallocated level fills up, it is folded into its own median and keeps
+# going, which only happens after k**levels samples.
+class ArrayRemedian:
+
+  def __init__(self, streams=1, k=64, levels=8, dtype=np.float32):
+    self.streams, self.k, self.levels = streams, k, levels
+    self.dtype = dtype
+    self.buffer = np.zeros((levels, streams, k), dtype)
+    self.counts = np.zeros((levels, streams), np.intp)
+    self.depth = np.zeros((streams,), np.intp)
+    self.medians = np.zeros((streams,), dtype)
+    self.dirty = np.zeros((streams,), bool)
+    # Shared fill counts and depth while all streams are in lockstep
+    self.lockstep = True
+    self.fill = [0] * levels
+    self.top = 0
+
+  # Add one sample per selected stream and push medians of full levels down.
+  def add(self, x, mask=None):
+    if mask is not None and not mask.all():
+      if not mask.any():
+        return
+      self._unlock()
+      self._add_masked(x, np.nonzero(mask)[0])
+      return
+    if not self.lockstep:
+      self._add_masked(x, np.arange(self.streams))
+      return
+    values = x
+    for level in range(self.levels):
+      count = self.fill[level]
+      self.buffer[level, :, count] = values
+      self.fill[level] = count + 1
+      if self.top == level:
+        self.dirty[:] = True
+      if count + 1 < self.k:
+        break
+      values = np.median(self.buffer[level], axis=1)
+      if level + 1 == self.levels:
+        self.buffer[level, :, 0] = values
+        self.fill[level] = 1
+        self.dirty[:] = True
+        break
+      self.fill[level] = 0
+      self.top = max(self.top, level + 1)
+
+  def _unlock(self):
+    if self.lockstep:
+      self.lockstep = False
+      self.counts[:] = np.array(self.fill)[:, np.newaxis]
+      self.depth[:] = self.top
+
+  def _add_masked(self, x, idx):
+    values = np.asarray(x, self.dtype).reshape((self.streams,))[idx]
+    for level in range(self.levels):
+      count = self.counts[level, idx]
+      self.buffer[level, idx, count] = values
+      self.counts[level, idx] = count + 1
+      self.dirty[idx[self.depth[idx] == level]] = True
+      full = count + 1 == self.k
+      if not full.any():
+        break
+      idx = idx[full]
+      values = np.median(self.buffer[level, idx], axis=1)
+      if level + 1 == self.levels:
+        self.buffer[level, idx, 0] = values
+        self.counts[level, idx] = 1
+        self.dirty[idx] = True
+        break
+      self.counts[level, idx] = 0
+      self.depth[idx] = np.maximum(self.depth[idx], level + 1)
+
+  # Medians of all streams. Streams without samples report 0.
+  def median(self):
+    if not self.dirty.any():
+      return self.medians
+    if self.lockstep:
+      self.medians[:] = np.median(self.buffer[self.top, :, 0:self.fill[self.top]], axis=1)
+    else:
+      idx = np.nonzero(self.dirty)[0]
+      depth = self.depth[idx]
+      count = self.counts[depth, idx]
+      for d, c in set(zip(depth.tolist(), count.tolist())):
+        sel = idx[(depth == d) & (count == c)]
+        self.medians[sel] = np.median(self.buffer[d, sel, 0:c], axis=1)
+    self.dirty[:] = False
+    return self.medians
@@ -0,0 +1,100 @@
+# =============================================================================
+# Tracking Log Replay for OpenSeeFace
+# =============================================================================
+#
+# Reads a recorded tracking data log, CSV or binary, and turns it back into
+# face objects that the output code of facetracker.py and
+# facetracker_vmc.py can send like live tracking results. No camera or
+# inference is needed, which makes it possible to load-test receivers and
+# measure sending throughput on its own.
+#
+# Frames are paced by their logged timestamps, optionally sped up, or sent
+# as fast as possible with a speed of 0. Every logged face can be sent
+# several times under different face ids to simulate more faces.
+#
+# Faces are rebuilt from the logged values. The gaze of each eye is taken
+# from landmarks 66 and 67, which the tracker fills from its eye state.
+# The adapted 3D face model is not logged, so face_3d and contour are None.
+#
+# Usage:
+#     source = ReplaySource("tracking.osflog", speed=1.0)
+#     for frame, width, height, faces in source:
+#         ...
+#
+# License: BSD 2-clause
+# =============================================================================
+
+import time
+
+import numpy as np
+
+from packet import features
+from tracking_log import read_records, landmark_order, flip_yz
+
+
+class ReplayFace():
+    def __init__(self, record, face_id):
+        self.id = face_id
+        self.alive = True
+        self.conf = float(record["conf"])
+        self.success = bool(record["success"])
+        self.pnp_error = float(record["pnp_error"])
+        self.quaternion = np.array(record["quaternion"])
+        self.euler = tuple(float(x) for x in record["euler"])
+        self.rotation = np.array(record["rotation"])
+        self.translation = np.array(record["translation"])
+        self.lms = np.array(record["landmarks"][:, landmark_order], np.float64)
+        self.pts_3d = record["points"] * flip_yz
+        self.eye_blink = [float(record["eye_blink"][0]), float(record["eye_blink"][1])]
+        self.eye_state = [[1.0, self.lms[66, 0], self.lms[66, 1], self.lms[66, 2]], [1.0, self.lms[67, 0], self.lms[67, 1], self.lms[67, 2]]]
+        self.current_features = {feature: float(value) for feature, value in zip(features, record["features"])}
+        x1, y1 = tuple(self.lms[0:66, 0:2].min(0))
+        x2, y2 = tuple(self.lms[0:66, 0:2].max(0))
+        self.bbox = (y1, x1, y2 - y1, x2 - x1)
+        self.face_3d = None
+        self.contour = None
+
+
+class ReplaySource():
+    def __init__(self, path, speed=1.0, copies=1, repeat=False):
+        self.records = read_records(path)
+        self.speed = speed
+        self.copies = max(copies, 1)
+        self.repeat = repeat
+        # Copies of a face get ids beyond all logged ids
+        self.id_stride = int(self.records["face_id"].max()) + 1 if len(self.records) > 0 else 1
+        # Start index of every logged frame, records of one frame are stored together
+        frames = self.records["frame"]
+        self.starts = np.flatnonzero(np.concatenate([[True], frames[1:] != frames[:-1]])) if len(self.records) > 0 else np.zeros((0,), np.int64)
+        self.ends = np.append(self.starts[1:], len(self.records))
+        self.frames_sent = 0
+        self.faces_sent = 0
+
+    def __len__(self):
+        return self.starts.shape[0]
+
+    def frame_faces(self, start, end):
+        faces = []
+        for n in range(self.copies):
+            for i in range(start, end):
+                record = self.records[i]
+                faces.append(ReplayFace(record, int(record["face_id"]) + n * self.id_stride))
+        return faces
+
+    def __iter__(self):
+        times = self.records["time"]
+        while len(self) > 0:
+            first_time = times[self.starts[0]]
+            start_time = time.perf_counter()
+            for start, end in zip(self.starts, self.ends):
+                if self.speed > 0:
+                    delay = (times[start] - first_time) / self.speed - (time.perf_counter() - start_time)
+                    if delay > 0:
+                        time.sleep(delay)
+                faces = self.frame_faces(start, end)
+                self.frames_sent += 1
+                self.faces_sent += len(faces)
+                record = self.records[start]
+                yield int(record["frame"]), int(record["width"]), int(record["height"]), faces
+            if not self.repeat:
+                break
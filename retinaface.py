@@ -7,6 +7,7 @@ import queue
 import threading
 import json
 import copy
+from iobinding import BoundSession
 
 def py_cpu_nms(dets, thresh):
     """ Pure Python NMS baseline.
@@ -68,7 +69,11 @@ class RetinaFaceDetector():
         options.log_severity_level = 3
         providersList = onnxruntime.capi._pybind_state.get_available_providers()
         self.session = onnxruntime.InferenceSession(model_path, sess_options=options, providers=providersList)
+        self.bound_session = BoundSession(self.session)
         self.res_w, self.res_h = res
+        self.resized = np.zeros((self.res_h, self.res_w, 3), np.uint8)
+        self.input = np.zeros((1, 3, self.res_h, self.res_w), np.float32)
+        self.mean = np.array((104, 117, 123), np.float32).reshape((3, 1, 1))
         with open(json_path, "r") as prior_file:
             self.priorbox = np.array(json.loads(prior_file.read()))
         self.min_conf = min_conf
@@ -80,18 +85,14 @@ class RetinaFaceDetector():
 
     def detect_retina(self, frame, is_background=False):
         h, w, _ = frame.shape
-        im = None
-        im = cv2.resize(frame, (self.res_w, self.res_h), interpolation=cv2.INTER_LINEAR)
+        im = cv2.resize(frame, (self.res_w, self.res_h), dst=self.resized, interpolation=cv2.INTER_LINEAR)
         resize_w = w / self.res_w
         resize_w = 1 / resize_w
         resize_h = h / self.res_h
         resize_h = 1 / resize_h
-        im = np.float32(im)
         scale = np.array((self.res_w / resize_w, self.res_h / resize_h, self.res_w / resize_w, self.res_h / resize_h))
-        im -= (104, 117, 123)
-        im = im.transpose(2, 0, 1)
-        im = np.expand_dims(im, 0)
-        output = self.session.run([], {"input0": im})
+        np.subtract(im.transpose(2, 0, 1), self.mean, out=self.input[0])
+        output = self.bound_session.run({"input0": self.input})
         loc, conf = output[0][0], output[1][0]
         boxes = decode(loc, self.priorbox, [0.1, 0.2])
         boxes = boxes * scale
@@ -85,7 +85,6 @@ try:
     import numpy
     import onnxruntime
     import PIL
-    from pythonosc import osc_message_builder
     print('✓ All dependencies installed successfully')
 except ImportError as e:
     print(f'✗ Missing dependency: {e}')
@@ -0,0 +1,292 @@
+# =============================================================================
+# Shared Memory Frame Transport for OpenSeeFace
+# =============================================================================
+#
+# Passes video frames from a capture process to the face tracker through a
+# ring buffer in shared memory, instead of piping raw RGB data through
+# standard input with --raw-rgb. The tracker reads frames in place, without
+# copying them.
+#
+# The shared memory block starts with a 64 byte header holding the frame
+# size, the number of slots, the sequence number of the newest frame, the
+# slots held by the reader and whether the writer has finished. It is
+# followed by a table with the sequence number and capture time of every
+# slot and then by the frame slots, each aligned to 64 bytes. Frames are 3
+# channel, 8 bit images in the same channel order as with --raw-rgb.
+#
+# The writer fills the slots in turn. A frame is published by storing its
+# sequence number, first in the slot table and then in the header, while a
+# slot being written has the sequence number 0. The reader always takes the
+# newest frame, so frames the tracker has no time for are skipped. Slots
+# still used by the reader are marked in the header and skipped by the
+# writer. When the reader has to hold more frames than the ring allows, it
+# copies them instead. The reader marks a slot before checking that it still
+# holds the frame, the writer clears the sequence number of a slot before
+# checking that it is not marked, so one of them always sees the other.
+#
+# Usage:
+#     Capture process:
+#         writer = SharedFrameWriter("osf_frames", 1920, 1080)
+#         writer.write(frame)
+#         ...
+#         writer.close()
+#
+#     Tracker:
+#         python facetracker.py --raw-shm osf_frames
+#
+#     Sending a video or camera for testing:
+#         python shm_frames.py -c video.mp4 --name osf_frames
+#
+# License: BSD 2-clause
+# =============================================================================
+
+import collections
+import os
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MAGIC = b"OSFFRAME"
+VERSION = 1
+ALIGNMENT = 64
+MAX_SLOTS = 64
+
+shm_header = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("width", "<u4"),
+    ("height", "<u4"),
+    ("slots", "<u4"),
+    ("latest", "<u8"),
+    ("held", "<u8"),
+    ("closed", "u1"),
+])
+shm_slot = np.dtype([
+    ("seq", "<u8"),
+    ("time", "<f8"),
+])
+
+
+fence_lock = threading.Lock()
+
+
+def fence():
+    # Taking a lock is a full memory barrier, so a store before it reaches the other process before a load after it
+    with fence_lock:
+        pass
+
+
+def align(size):
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def shm_size(width, height, slots):
+    # Offsets of the slot table and the first frame, the size of a frame slot and the total size
+    table = align(shm_header.itemsize)
+    frames = align(table + slots * shm_slot.itemsize)
+    frame_size = align(width * height * 3)
+    return table, frames, frame_size, frames + slots * frame_size
+
+
+def map_frames(shm, width, height, slots):
+    table_offset, frames_offset, frame_size, _ = shm_size(width, height, slots)
+    header = np.ndarray((), shm_header, shm.buf)
+    table = np.ndarray((slots,), shm_slot, shm.buf, table_offset)
+    frames = [np.ndarray((height, width, 3), np.uint8, shm.buf, frames_offset + i * frame_size) for i in range(slots)]
+    return header, table, frames
+
+
+def attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13, the block would be removed when this process exits
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name != 'nt':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class SharedFrameWriter():
+    def __init__(self, name, width, height, slots=4):
+        if slots < 2 or slots > MAX_SLOTS:
+            raise ValueError(f"The number of slots has to be between 2 and {MAX_SLOTS}")
+        self.width = int(width)
+        self.height = int(height)
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=shm_size(self.width, self.height, slots)[3])
+        self.name = self.shm.name
+        self.header, self.table, self.frames = map_frames(self.shm, self.width, self.height, slots)
+        self.header["magic"] = MAGIC
+        self.header["version"] = VERSION
+        self.header["width"] = self.width
+        self.header["height"] = self.height
+        self.header["slots"] = slots
+        self.header["latest"] = 0
+        self.header["held"] = 0
+        self.header["closed"] = 0
+        self.table["seq"] = 0
+        self.seq = 0
+        self.slot = -1
+        self.next_slot = None
+
+    def buffer(self):
+        # The slot the next frame goes into, producers can fill it in place and then call commit
+        if self.next_slot is None:
+            slot = self.slot
+            while True:
+                held = int(self.header["held"])
+                for i in range(self.slots):
+                    slot = (slot + 1) % self.slots
+                    if not held & (1 << slot):
+                        break
+                self.table["seq"][slot] = 0
+                fence()
+                # The reader may have marked the slot after the mask was read, it then either sees the cleared slot or is seen here
+                if not int(self.header["held"]) & (1 << slot):
+                    break
+            self.next_slot = slot
+        return self.frames[self.next_slot]
+
+    def commit(self, timestamp=None):
+        self.buffer()
+        slot = self.next_slot
+        self.seq += 1
+        self.table["time"][slot] = time.time() if timestamp is None else timestamp
+        self.table["seq"][slot] = self.seq
+        self.header["latest"] = self.seq
+        self.slot = slot
+        self.next_slot = None
+
+    def write(self, frame, timestamp=None):
+        np.copyto(self.buffer(), frame)
+        self.commit(timestamp)
+
+    def close(self, unlink=True):
+        # Readers that already attached keep their mapping until they close
+        self.header["closed"] = 1
+        del self.header, self.table, self.frames
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class SharedFrameReader():
+    def __init__(self, name, hold=1):
+        self.shm = attach(name)
+        self.name = name
+        header = np.ndarray((), shm_header, self.shm.buf)
+        if bytes(header["magic"]) != MAGIC or int(header["version"]) != VERSION:
+            del header
+            self.shm.close()
+            raise ValueError(f"The shared memory block {name} does not hold OpenSeeFace frames")
+        self.width = int(header["width"])
+        self.height = int(header["height"])
+        self.slots = int(header["slots"])
+        del header
+        self.header, self.table, self.frames = map_frames(self.shm, self.width, self.height, self.slots)
+        # The frames returned by the last hold reads stay valid, at least one slot has to stay free for the writer
+        self.copy = hold > self.slots - 1
+        self.hold = 1 if self.copy else max(hold, 1)
+        self.held = collections.deque()
+        self.last_seq = 0
+        self.time = 0.0
+        self.open = True
+
+    def hold_slot(self, slot):
+        if slot in self.held:
+            self.held.remove(slot)
+        self.held.append(slot)
+        while len(self.held) > self.hold:
+            self.held.popleft()
+        mask = 0
+        for held in self.held:
+            mask |= 1 << held
+        self.header["held"] = mask
+        fence()
+
+    def is_open(self):
+        return self.open and (self.header["closed"] == 0 or self.is_ready())
+
+    def is_ready(self):
+        return int(self.header["latest"]) > self.last_seq
+
+    def read(self):
+        while True:
+            seq = int(self.header["latest"])
+            if seq <= self.last_seq:
+                return False, None
+            slots = np.flatnonzero(self.table["seq"] == seq)
+            if slots.shape[0] == 0:
+                # The writer already reused the slot
+                continue
+            slot = int(slots[0])
+            self.hold_slot(slot)
+            if int(self.table["seq"][slot]) == seq:
+                break
+        self.last_seq = seq
+        self.time = float(self.table["time"][slot])
+        frame = self.frames[slot]
+        if self.copy:
+            frame = frame.copy()
+            self.held.clear()
+            self.header["held"] = 0
+        return True, frame
+
+    def close(self):
+        if not self.open:
+            return
+        self.open = False
+        self.header["held"] = 0
+        del self.header, self.table, self.frames
+        try:
+            self.shm.close()
+        except BufferError:
+            # Frames returned by read are still in use, the mapping goes away with them
+            pass
+
+
+if __name__ == "__main__":
+    import argparse
+    import cv2
+
+    parser = argparse.ArgumentParser(description="Send the frames of a video or camera to a shared memory block for facetracker.py --raw-shm")
+    parser.add_argument("-c", "--capture", help="Set camera ID (0, 1...) or video file", default="0")
+    parser.add_argument("--name", help="Set the name of the shared memory block", default="osf_frames")
+    parser.add_argument("--slots", type=int, help="Set the number of frames in the ring buffer", default=4)
+    parser.add_argument("-F", "--fps", type=float, help="Limit the frame rate, 0 sends frames as fast as they are read", default=0)
+    parser.add_argument("--repeat", action="store_true", help="Loop a video file until interrupted")
+    args = parser.parse_args()
+
+    capture = int(args.capture) if args.capture.isdigit() else args.capture
+    cap = cv2.VideoCapture(capture)
+    writer = None
+    frames = 0
+    try:
+        while True:
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            if not ret:
+                if args.repeat and frames > 0:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                break
+            if writer is None:
+                writer = SharedFrameWriter(args.name, frame.shape[1], frame.shape[0], slots=args.slots)
+                print(f"Sending {frame.shape[1]}x{frame.shape[0]} frames to shared memory block {writer.name}")
+            writer.write(frame)
+            frames += 1
+            if args.fps > 0:
+                delay = 1.0 / args.fps - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.close()
+    print(f"Sent {frames} frames")
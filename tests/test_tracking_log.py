@@ -0,0 +1,70 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from packet import features
+from tracking_log import TrackingLogWriter, read_records
+
+
+def make_face(face_id, rotation):
+    return SimpleNamespace(
+        id=face_id,
+        eye_blink=[1.0, 1.0],
+        conf=0.9,
+        success=True,
+        pnp_error=1.0,
+        quaternion=np.array([0.0, 0.0, 0.0, 1.0]),
+        euler=np.zeros(3),
+        rotation=rotation,
+        translation=np.array([1.0, 2.0, 3.0]),
+        lms=np.ones((68, 3), np.float32),
+        pts_3d=np.ones((70, 3), np.float32),
+        current_features={feature: 0.0 for feature in features},
+    )
+
+
+@pytest.mark.parametrize("format", ["csv", "binary"])
+def test_missing_pose_is_logged_without_losing_other_faces(tmp_path, format):
+    path = str(tmp_path / "log")
+    log = TrackingLogWriter(path, format=format)
+    for frame in range(3):
+        log.write_face(frame, 0.0, 640, 480, 30, 0, make_face(0, np.array([0.1, 0.2, 0.3])))
+        # A face whose pose was reset after a failed 3D fit
+        log.write_face(frame, 0.0, 640, 480, 30, 1, make_face(1, None))
+    log.close()
+
+    records = read_records(path)
+    assert len(records) == 6
+    assert np.allclose(records["rotation"][records["face_id"] == 0], [0.1, 0.2, 0.3])
+    assert np.allclose(records["rotation"][records["face_id"] == 1], 0.0)
+
+
+def test_pose_is_copied_when_queued(tmp_path):
+    path = str(tmp_path / "log.csv")
+    log = TrackingLogWriter(path)
+    face = make_face(0, np.array([0.1, 0.2, 0.3]))
+    log.write_face(0, 0.0, 640, 480, 30, 0, face)
+    # solvePnP updates the arrays of the tracked face in place
+    face.rotation[:] = 5.0
+    log.close()
+
+    assert np.allclose(read_records(path)["rotation"], [0.1, 0.2, 0.3])
+
+
+def test_unformattable_face_only_drops_its_own_row(tmp_path, capsys):
+    path = str(tmp_path / "log.csv")
+    log = TrackingLogWriter(path)
+    broken = make_face(1, np.zeros(3))
+    broken.current_features = {}
+    log.write_face(0, 0.0, 640, 480, 30, 0, make_face(0, np.zeros(3)))
+    log.write_face(0, 0.0, 640, 480, 30, 1, broken)
+    log.write_face(1, 0.0, 640, 480, 30, 0, make_face(0, np.zeros(3)))
+    log.close()
+
+    assert list(read_records(path)["face_id"]) == [0, 0]
+    assert "KeyError" in capsys.readouterr().err
@@ -7,9 +7,13 @@ import time
 import queue
 import threading
 import copy
+import traceback
 from similaritytransform import SimilarityTransform
 from retinaface import RetinaFaceDetector
-from remedian import remedian
+from remedian import ArrayRemedian
+from iobinding import BoundSession
+from metrics import TrackerMetrics
+from motion import BoxFilter
 
 def resolve(name):
     f = os.path.join(os.path.dirname(__file__), name)
@@ -135,21 +139,39 @@ def matrix_to_quaternion(m):
     q = np.array(q, np.float32) * 0.5 / np.sqrt(t)
     return q
 
-def worker_thread(session, frame, input, crop_info, queue, input_name, idx, tracker):
-    output = session.run([], {input_name: input})[0]
-    conf, lms = tracker.landmarks(output[0], crop_info)
-    if conf > tracker.threshold:
+def worker_thread(session, jobs, results, input_name, tracker, gaze_context):
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        frame, input, crop_info, idx = job
         try:
-            eye_state = tracker.get_eye_state(frame, lms)
+            output = session.run({input_name: input})[0]
+            conf, lms = tracker.landmarks(output[0], crop_info)
         except:
-            eye_state = [(1.0, 0.0, 0.0, 0.0), (1.0, 0.0, 0.0, 0.0)]
-        queue.put((session, conf, (lms, eye_state), crop_info, idx))
-    else:
-        queue.put((session,))
+            if not tracker.silent:
+                traceback.print_exc()
+            results.put(None)
+            continue
+        if conf > tracker.threshold:
+            try:
+                eye_state = tracker.get_eye_state(frame, lms, gaze_context)
+            except:
+                eye_state = [(1.0, 0.0, 0.0, 0.0), (1.0, 0.0, 0.0, 0.0)]
+            results.put((conf, (lms, eye_state), crop_info, idx))
+        else:
+            results.put(None)
+
+class GazeContext():
+    # Preallocated eye crop, gaze model input and gaze model binding for one thread
+    def __init__(self, session):
+        self.resized = np.zeros((32, 32, 3), np.uint8)
+        self.input = np.zeros((2, 3, 32, 32), np.float32)
+        self.session = BoundSession(session)
 
 class Feature():
     def __init__(self, threshold=0.15, alpha=0.2, hard_factor=0.15, decay=0.001, max_feature_updates=0):
-        self.median = remedian()
+        self.median = ArrayRemedian()
         self.min = None
         self.max = None
         self.hard_min = None
@@ -177,8 +199,8 @@ class Feature():
     def update_state(self, x, now=0):
         updating = self.updating and (self.max_feature_updates == 0 or now - self.first_seen < self.max_feature_updates)
         if updating:
-            self.median + x
-            self.current_median = self.median.median()
+            self.median.add(x)
+            self.current_median = self.median.median()[0]
         else:
             self.updating = False
         median = self.current_median
@@ -224,103 +246,162 @@ class Feature():
         return 0
 
 class FeatureExtractor():
-    def __init__(self, max_feature_updates=0):
-        self.eye_l = Feature(max_feature_updates=max_feature_updates)
-        self.eye_r = Feature(max_feature_updates=max_feature_updates)
-        self.eyebrow_updown_l = Feature(max_feature_updates=max_feature_updates)
-        self.eyebrow_updown_r = Feature(max_feature_updates=max_feature_updates)
-        self.eyebrow_quirk_l = Feature(threshold=0.05, max_feature_updates=max_feature_updates)
-        self.eyebrow_quirk_r = Feature(threshold=0.05, max_feature_updates=max_feature_updates)
-        self.eyebrow_steepness_l = Feature(threshold=0.05, max_feature_updates=max_feature_updates)
-        self.eyebrow_steepness_r = Feature(threshold=0.05, max_feature_updates=max_feature_updates)
-        self.mouth_corner_updown_l = Feature(max_feature_updates=max_feature_updates)
-        self.mouth_corner_updown_r = Feature(max_feature_updates=max_feature_updates)
-        self.mouth_corner_inout_l = Feature(threshold=0.02, max_feature_updates=max_feature_updates)
-        self.mouth_corner_inout_r = Feature(threshold=0.02, max_feature_updates=max_feature_updates)
-        self.mouth_open = Feature(max_feature_updates=max_feature_updates)
-        self.mouth_wide = Feature(threshold=0.02, max_feature_updates=max_feature_updates)
-
-    def align_points(self, a, b, pts):
-        a = tuple(a)
-        b = tuple(b)
-        alpha = angle(a, b)
-        alpha = np.rad2deg(alpha)
-        if alpha >= 90:
-            alpha = - (alpha - 180)
-        if alpha <= -90:
-            alpha = - (alpha + 180)
+    names = ["eye_l", "eye_r", "eyebrow_steepness_l", "eyebrow_updown_l", "eyebrow_quirk_l", "eyebrow_steepness_r", "eyebrow_updown_r", "eyebrow_quirk_r", "mouth_corner_updown_l", "mouth_corner_inout_l", "mouth_corner_updown_r", "mouth_corner_inout_r", "mouth_open", "mouth_wide"]
+
+    def __init__(self, max_feature_updates=0, alpha=0.2, hard_factor=0.15, decay=0.001):
+        # The state of all features is kept in arrays ordered like names and
+        # updated in one pass, following the same arithmetic as Feature
+        n = len(self.names)
+        self.threshold = np.full((n,), 0.15, np.float32)
+        self.threshold[[2, 4, 5, 7]] = 0.05
+        self.threshold[[9, 11, 13]] = 0.02
+        self.alpha = alpha
+        self.hard_factor = np.float32(hard_factor)
+        self.decay = np.float32(decay)
+        self.max_feature_updates = max_feature_updates
+        self.median = ArrayRemedian(n)
+        self.current_median = np.zeros((n,), np.float32)
+        self.min = np.zeros((n,), np.float32)
+        self.max = np.zeros((n,), np.float32)
+        self.hard_min = np.zeros((n,), np.float32)
+        self.hard_max = np.zeros((n,), np.float32)
+        self.has_min = np.zeros((n,), bool)
+        self.has_max = np.zeros((n,), bool)
+        # Feature.last starts out as a Python number and only turns into a
+        # float32 once the first non-constant value has been filtered into it
+        self.last = np.zeros((n,), np.float64)
+        self.last_f32 = np.zeros((n,), bool)
+        self.first_seen = np.full((n,), -1.0)
+        self.updating = np.ones((n,), bool)
+        self.full = np.ones((n,), bool)
+        self.partial = np.ones((n,), bool)
+        self.partial[[2, 4, 5, 7, 9, 11]] = False
+
+        # Point pairs used for alignment and the points rotated with each of them
+        self.align_a = np.array([42, 36, 0, 31, 22, 17])
+        self.align_b = np.array([45, 39, 16, 35, 26, 21])
+        self.align_groups = np.array([0, 0, 0, 0, 1, 1, 1, 1, 4, 4, 4, 4, 4, 5, 5, 5, 5, 5])
+        self.align_pts = np.array([43, 44, 47, 46, 37, 38, 41, 40, 22, 23, 24, 25, 26, 17, 18, 19, 20, 21])
+        self.align_origin = self.align_a[self.align_groups]
+
+    def align_points(self, pts):
+        d = pts[self.align_b] - pts[self.align_a]
+        alpha = np.rad2deg(np.arctan2(d[:, 1], d[:, 0]) % (2 * np.pi))
+        alpha = np.where(alpha >= 90, -(alpha - 180), alpha)
+        alpha = np.where(alpha <= -90, -(alpha + 180), alpha)
         alpha = np.deg2rad(alpha)
-        aligned_pts = []
-        for pt in pts:
-            aligned_pts.append(np.array(rotate(a, pt, alpha)))
-        return alpha, np.array(aligned_pts)
+        # Rotate all points around their group's origin at once, written out
+        # elementwise in the same order as rotate() so results stay identical
+        angles = [-a for a in alpha.tolist()]
+        cos = np.array([math.cos(a) for a in angles], np.float32)[self.align_groups]
+        sin = np.array([math.sin(a) for a in angles], np.float32)[self.align_groups]
+        origin = pts[self.align_origin]
+        d = pts[self.align_pts] - origin
+        aligned_pts = np.empty(d.shape, np.float32)
+        aligned_pts[:, 0] = origin[:, 0] + cos * d[:, 0] - sin * d[:, 1]
+        aligned_pts[:, 1] = origin[:, 1] + sin * d[:, 0] + cos * d[:, 1]
+        return alpha, aligned_pts
+
+    def measure(self, pts):
+        x = pts[:, 0]
+        y = pts[:, 1]
+        # Sums divided by counts match np.mean bit for bit on these small arrays
+        norm_distance_x = (x[[0, 1]] - x[[16, 15]]).sum() / 2
+        norm_distance_y = (y[[27, 28, 29]] - y[[28, 29, 30]]).sum() / 3
+
+        alpha, f_pts = self.align_points(pts)
+        f = np.zeros((len(self.names),), np.float32)
+
+        eyes = f_pts[0:8, 1].reshape((2, 4))
+        f[0:2] = abs(((eyes[:, 0] + eyes[:, 1]) / 2 - (eyes[:, 2] + eyes[:, 3]) / 2) / norm_distance_y)
+
+        norm_angle = np.rad2deg(alpha[0:4]).sum() / 4
+        f[2] = -np.rad2deg(alpha[4]) - norm_angle
+        f[5] = np.rad2deg(alpha[5]) - norm_angle
+        f[4] = np.max(np.abs(f_pts[9:12] - f_pts[8, 1])) / norm_distance_y
+        f[7] = np.max(np.abs(f_pts[14:17] - f_pts[13, 1])) / norm_distance_y
+
+        f[[3, 6]] = ((y[[22, 17]] + y[[26, 21]]) / 2 - y[27]) / norm_distance_y
+
+        upper_mouth_line = y[[49, 50, 51]].sum() / 3
+        center_line = x[[50, 60, 27, 30, 64, 55]].sum() / 6
+        f[[8, 10]] = (upper_mouth_line - y[[62, 58]]) / norm_distance_y
+        f[[9, 11]] = abs(center_line - x[[62, 58]]) / norm_distance_x
+
+        f[12] = abs(y[[59, 60, 61]].sum() / 3 - y[[63, 64, 65]].sum() / 3) / norm_distance_y
+        f[13] = abs(x[58] - x[62]) / norm_distance_x
+        return f
+
+    def update_state(self, x, active, now):
+        updating = active & self.updating & ((self.max_feature_updates == 0) | (now - self.first_seen < self.max_feature_updates))
+        if updating.any():
+            self.median.add(x, updating)
+            self.current_median = np.where(updating, self.median.median(), self.current_median)
+        self.updating[active & ~updating] = False
+        median = self.current_median
+        hf = self.hard_factor
+
+        below = x < median
+        above = x > median
+        lower = self.has_min & (x < self.min)
+        rest = self.has_min & ~lower
+        higher = rest & self.has_max & (x > self.max)
+        new_min = (~self.has_min & below & ((median - x) / median > self.threshold)) | lower
+        new_max = rest & ((~self.has_max & above & ((x - median) / median > self.threshold)) | higher)
+        # Only features with both a minimum and a maximum that were not exceeded get a scaled value
+        scaled = rest & self.has_max & ~higher
+
+        set_min = new_min & updating
+        self.min = np.where(set_min, x, self.min)
+        self.hard_min = np.where(set_min, self.min + hf * (median - self.min), self.hard_min)
+        self.has_min |= set_min
+        set_max = new_max & updating
+        self.max = np.where(set_max, x, self.max)
+        self.hard_max = np.where(set_max, self.max - hf * (self.max - median), self.hard_max)
+        self.has_max |= set_max
+
+        decay_min = scaled & updating & (self.min < self.hard_min)
+        self.min = np.where(decay_min, self.hard_min * self.decay + self.min * (1 - self.decay), self.min)
+        decay_max = scaled & updating & (self.max > self.hard_max)
+        self.max = np.where(decay_max, self.hard_max * self.decay + self.max * (1 - self.decay), self.max)
+
+        state = np.where(new_min, -1, np.where(new_max, 1, 0)).astype(np.float32)
+        value = np.where(below, - (1 - (x - self.min) / (median - self.min)), np.where(above, (x - median) / (self.max - median), 0))
+        state = np.where(scaled, value, state)
+        # Feature.update_state returns these as the integer constants -1, 0 or 1
+        constant = ~scaled | ~(below | above)
+        return state, constant
+
+    def update(self, pts, full=True, now=None):
+        if now is None:
+            now = time.perf_counter()
+        active = self.full if full else self.partial
+        if self.max_feature_updates > 0:
+            self.first_seen[active & (self.first_seen == -1)] = now
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new, constant = self.update_state(self.measure(pts), active, now)
+
+            # Exponential smoothing, in float32 except while both the last
+            # value and the new state are still plain Python numbers
+            alpha = self.alpha
+            last = np.where(self.last_f32, np.float32(self.last) * np.float32(alpha), np.float32(self.last * alpha))
+            filtered_f32 = last + new * np.float32(1 - alpha)
+            filtered_f64 = self.last * alpha + new.astype(np.float64) * (1 - alpha)
+        as_f32 = active & (self.last_f32 | ~constant)
+        as_f64 = active & ~as_f32
+        self.last[as_f32] = filtered_f32[as_f32]
+        self.last[as_f64] = filtered_f64[as_f64]
+        self.last_f32 |= as_f32
 
-    def update(self, pts, full=True):
         features = {}
-        now = time.perf_counter()
-
-        norm_distance_x = np.mean([pts[0, 0] - pts[16, 0], pts[1, 0] - pts[15, 0]])
-        norm_distance_y = np.mean([pts[27, 1] - pts[28, 1], pts[28, 1] - pts[29, 1], pts[29, 1] - pts[30, 1]])
-
-        a1, f_pts = self.align_points(pts[42], pts[45], pts[[43, 44, 47, 46]])
-        f = abs((np.mean([f_pts[0,1], f_pts[1,1]]) - np.mean([f_pts[2,1], f_pts[3,1]])) / norm_distance_y)
-        features["eye_l"] = self.eye_l.update(f, now)
-
-        a2, f_pts = self.align_points(pts[36], pts[39], pts[[37, 38, 41, 40]])
-        f = abs((np.mean([f_pts[0,1], f_pts[1,1]]) - np.mean([f_pts[2,1], f_pts[3,1]])) / norm_distance_y)
-        features["eye_r"] = self.eye_r.update(f, now)
-
-        if full:
-            a3, _ = self.align_points(pts[0], pts[16], [])
-            a4, _ = self.align_points(pts[31], pts[35], [])
-            norm_angle = np.mean(list(map(np.rad2deg, [a1, a2, a3, a4])))
-
-            a, f_pts = self.align_points(pts[22], pts[26], pts[[22, 23, 24, 25, 26]])
-            features["eyebrow_steepness_l"] = self.eyebrow_steepness_l.update(-np.rad2deg(a) - norm_angle, now)
-            f = np.max(np.abs(np.array(f_pts[1:4]) - f_pts[0, 1])) / norm_distance_y
-            features["eyebrow_quirk_l"] = self.eyebrow_quirk_l.update(f, now)
-
-            a, f_pts = self.align_points(pts[17], pts[21], pts[[17, 18, 19, 20, 21]])
-            features["eyebrow_steepness_r"] = self.eyebrow_steepness_r.update(np.rad2deg(a) - norm_angle, now)
-            f = np.max(np.abs(np.array(f_pts[1:4]) - f_pts[0, 1])) / norm_distance_y
-            features["eyebrow_quirk_r"] = self.eyebrow_quirk_r.update(f, now)
-        else:
-            features["eyebrow_steepness_l"] = 0.
-            features["eyebrow_steepness_r"] = 0.
-            features["eyebrow_quirk_l"] = 0.
-            features["eyebrow_quirk_r"] = 0.
-
-        f = (np.mean([pts[22, 1], pts[26, 1]]) - pts[27, 1]) / norm_distance_y
-        features["eyebrow_updown_l"] = self.eyebrow_updown_l.update(f, now)
-
-        f = (np.mean([pts[17, 1], pts[21, 1]]) - pts[27, 1]) / norm_distance_y
-        features["eyebrow_updown_r"] = self.eyebrow_updown_r.update(f, now)
-
-        upper_mouth_line = np.mean([pts[49, 1], pts[50, 1], pts[51, 1]])
-        center_line = np.mean([pts[50, 0], pts[60, 0], pts[27, 0], pts[30, 0], pts[64, 0], pts[55, 0]])
-
-        f = (upper_mouth_line - pts[62, 1]) / norm_distance_y
-        features["mouth_corner_updown_l"] = self.mouth_corner_updown_l.update(f, now)
-        if full:
-            f = abs(center_line - pts[62, 0]) / norm_distance_x
-            features["mouth_corner_inout_l"] = self.mouth_corner_inout_l.update(f, now)
-        else:
-            features["mouth_corner_inout_l"] = 0.
-
-        f = (upper_mouth_line - pts[58, 1]) / norm_distance_y
-        features["mouth_corner_updown_r"] = self.mouth_corner_updown_r.update(f, now)
-        if full:
-            f = abs(center_line - pts[58, 0]) / norm_distance_x
-            features["mouth_corner_inout_r"] = self.mouth_corner_inout_r.update(f, now)
-        else:
-            features["mouth_corner_inout_r"] = 0.
-
-        f = abs(np.mean(pts[[59,60,61], 1], axis=0) - np.mean(pts[[63,64,65], 1], axis=0)) / norm_distance_y
-        features["mouth_open"] = self.mouth_open.update(f, now)
-
-        f = abs(pts[58, 0] - pts[62, 0]) / norm_distance_x
-        features["mouth_wide"] = self.mouth_wide.update(f, now)
-
+        for i, name in enumerate(self.names):
+            if not active[i]:
+                features[name] = 0.
+            elif self.last_f32[i]:
+                features[name] = np.float32(self.last[i])
+            else:
+                features[name] = float(self.last[i])
         return features
 
 class FaceInfo():
@@ -335,6 +416,10 @@ class FaceInfo():
         self.reset()
         self.alive = False
         self.coord = None
+        self.motion = BoxFilter()
+        # Landmarks and eye state of the last frame the landmark model ran on
+        self.key_lms = None
+        self.key_eye_state = None
         self.base_scale_v = self.tracker.face_3d[27:30, 1] - self.tracker.face_3d[28:31, 1]
         self.base_scale_h = np.abs(self.tracker.face_3d[[0, 36, 42], 0] - self.tracker.face_3d[[16, 39, 45], 0])
 
@@ -373,6 +458,9 @@ class FaceInfo():
         if result is None:
             self.reset()
         else:
+            if not self.alive:
+                # A newly found face starts with a fresh motion model
+                self.motion.reset()
             self.conf, (self.lms, self.eye_state) = result
             self.coord = coord
             self.alive = True
@@ -494,7 +582,7 @@ def get_model_base_path(model_dir):
     return model_base_path
 
 class Tracker():
-    def __init__(self, width, height, model_type=3, detection_threshold=0.6, threshold=None, max_faces=1, discard_after=5, scan_every=3, bbox_growth=0.0, max_threads=4, silent=False, model_dir=None, no_gaze=False, use_retinaface=False, max_feature_updates=0, static_model=False, feature_level=2, try_hard=False):
+    def __init__(self, width, height, model_type=3, detection_threshold=0.6, threshold=None, max_faces=1, discard_after=5, scan_every=3, bbox_growth=0.0, max_threads=4, silent=False, model_dir=None, no_gaze=False, use_retinaface=False, max_feature_updates=0, static_model=False, feature_level=2, try_hard=False, batch_inference=False, motion_model=False, max_skip=0, skip_motion=0.01, local_search=False, search_scale=3.0, idle_interval=0, idle_motion=0.0, focused_scan=False, scan_motion=12.0, frame_budget=0.0):
         options = onnxruntime.SessionOptions()
         options.inter_op_num_threads = 1
         options.intra_op_num_threads = min(max_threads,4)
@@ -560,6 +648,19 @@ class Tracker():
         self.gaze_model = onnxruntime.InferenceSession(os.path.join(model_base_path, "mnv3_gaze32_split_opt.onnx"), sess_options=options, providers=providersList)
 
         self.detection = onnxruntime.InferenceSession(os.path.join(model_base_path, "mnv3_detection_opt.onnx"), sess_options=options, providers=providersList)
+
+        # Sessions run through IO bindings, reusing their input and output buffers across frames
+        self.bound_session = BoundSession(self.session)
+        self.bound_detection = BoundSession(self.detection)
+
+        # One long-lived worker per session, fed through a shared job queue
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.workers = []
+        for session in self.sessions:
+            worker = threading.Thread(target=worker_thread, args=(BoundSession(session), self.jobs, self.results, self.input_name, self, GazeContext(self.gaze_model)), daemon=True)
+            worker.start()
+            self.workers.append(worker)
         self.faces = []
 
         # Image normalization constants
@@ -574,6 +675,9 @@ class Tracker():
         self.std_32 = np.tile(self.std, [32, 32, 1])
         self.mean_224 = np.tile(self.mean, [224, 224, 1])
         self.std_224 = np.tile(self.std, [224, 224, 1])
+        # Per channel constants for normalizing straight into NCHW buffers
+        self.mean_c = self.mean.reshape((3, 1, 1))
+        self.std_c = self.std.reshape((3, 1, 1))
 
         # PnP solving
         self.face_3d = np.array([
@@ -669,6 +773,34 @@ class Tracker():
         self.bbox_growth = bbox_growth
         self.silent = silent
         self.try_hard = try_hard
+        self.batch_inference = batch_inference
+        self.motion_model = motion_model
+        # Faces whose motion model predicts the crops while all faces are lost
+        self.motion_faces = []
+        # Skipping the landmark model while faces hold still, movement is measured relative to the face size
+        self.max_skip = max_skip
+        self.skip_motion = skip_motion
+        self.max_flow_error = 20.0
+        self.skipped = 0
+        self.key_gray = None
+        # Searching around the last positions of lost faces before the whole frame, regions are search_scale times the face size
+        self.local_search = local_search
+        self.search_scale = search_scale
+        # While no face is found, detection runs every 1, 2, 4... up to idle_interval frames, or right away when the image changes by idle_motion
+        self.idle_interval = idle_interval
+        self.idle_motion = idle_motion
+        self.idle_step = 1
+        self.idle_wait = 0
+        self.idle_gray = None
+        # Scans for additional faces skip tracked faces and only cover regions where the gray level changed by scan_motion
+        self.focused_scan = focused_scan
+        self.scan_motion = scan_motion
+        self.scan_gray = None
+        # With a frame budget in ms, scans run less often when they would not fit into the time left by tracking
+        self.frame_budget = frame_budget
+        self.max_scan_factor = 10
+        self.scan_cost = 0.0
+        self.last_frame_ms = 0.0
 
         self.res = 224.
         self.mean_res = self.mean_224
@@ -682,6 +814,14 @@ class Tracker():
             self.mean_res = np.tile(self.mean, [112, 112, 1])
             self.std_res = np.tile(self.std, [112, 112, 1])
         self.res_i = int(self.res)
+
+        # Preallocated model inputs and intermediate images
+        self.detect_resized = np.zeros((224, 224, 3), np.uint8)
+        self.detect_input = np.zeros((1, 3, 224, 224), np.float32)
+        self.crop_scratch = np.zeros((0, 0, 3), np.float32)
+        self.crop_resized = np.zeros((self.res_i, self.res_i, 3), np.float32)
+        self.crop_buffer = np.zeros((max(max_faces, 1), 3, self.res_i, self.res_i), np.float32)
+        self.gaze_context = GazeContext(self.gaze_model)
         self.out_res = 27.
         if model_type < 0:
             self.out_res = 6.
@@ -703,14 +843,19 @@ class Tracker():
         self.static_model = static_model
         self.face_info = [FaceInfo(id, self) for id in range(max_faces)]
         self.fail_count = 0
-
-    def detect_faces(self, frame):
-        im = cv2.resize(frame, (224, 224), interpolation=cv2.INTER_LINEAR)[:,:,::-1] * self.std_224 + self.mean_224
-        im = np.expand_dims(im, 0)
-        im = np.transpose(im, (0,3,1,2))
-        outputs, maxpool = self.detection.run([], {'input': im})
-        outputs = np.array(outputs)
-        maxpool = np.array(maxpool)
+        self.metrics = TrackerMetrics(max_faces)
+
+    def detect_faces(self, frame, masks=()):
+        resized = cv2.resize(frame, (224, 224), dst=self.detect_resized, interpolation=cv2.INTER_LINEAR)
+        for (x, y, w, h) in masks:
+            # Blank out regions that should not be searched, given as boxes in frame coordinates
+            x1, y1 = clamp_to_im((x * 224. / frame.shape[1], y * 224. / frame.shape[0]), 224, 224)
+            x2, y2 = clamp_to_im(((x + w) * 224. / frame.shape[1] + 1, (y + h) * 224. / frame.shape[0] + 1), 224, 224)
+            resized[y1:y2, x1:x2] = 0
+        im = self.detect_input
+        np.multiply(resized[:,:,::-1].transpose((2,0,1)), self.std_c, out=im[0])
+        np.add(im[0], self.mean_c, out=im[0])
+        outputs, maxpool = self.bound_detection.run({'input': im})
         outputs[0, 0, outputs[0, 0] != maxpool[0, 0]] = 0
         detections = np.flip(np.argsort(outputs[0,0].flatten()))
         results = []
@@ -730,6 +875,103 @@ class Tracker():
             results[:, [1,3]] *= frame.shape[0] / 224.
         return results
 
+    def idle_skip(self, frame):
+        # Decides whether to skip the detection on a frame without tracked faces
+        if self.idle_interval <= 0:
+            return False
+        small = None
+        if self.idle_motion > 0:
+            small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 48), interpolation=cv2.INTER_AREA)
+            if self.idle_gray is not None and cv2.absdiff(small, self.idle_gray).mean() > self.idle_motion:
+                # Something moved, search at the full rate again
+                self.idle_step = 1
+                self.idle_wait = 0
+        if self.idle_wait > 0:
+            self.idle_wait -= 1
+            return True
+        self.idle_gray = small
+        self.idle_wait = self.idle_step - 1
+        self.idle_step = min(2 * self.idle_step, self.idle_interval)
+        return False
+
+    def expand_faces(self, factor):
+        faces = []
+        for (x, y, w, h) in self.faces:
+            faces.append((x - w * factor / 2.0, y - h * factor / 2.0, w * (1.0 + factor), h * (1.0 + factor)))
+        return faces
+
+    def scan_region(self, frame):
+        # Returns the region (x1, y1, x2, y2) that changed outside of the tracked faces since the last scan, or None when nothing changed
+        small = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (64, 48), interpolation=cv2.INTER_AREA)
+        if self.scan_gray is None:
+            self.scan_gray = small
+            return (0, 0, self.width, self.height)
+        moved = cv2.absdiff(small, self.scan_gray) > self.scan_motion
+        scale_x = 64. / self.width
+        scale_y = 48. / self.height
+        for (x, y, w, h) in self.expand_faces(0.5):
+            x1, y1 = clamp_to_im((x * scale_x, y * scale_y), 64, 48)
+            x2, y2 = clamp_to_im(((x + w) * scale_x + 1, (y + h) * scale_y + 1), 64, 48)
+            moved[y1:y2, x1:x2] = False
+        ys, xs = np.nonzero(moved)
+        if ys.shape[0] == 0:
+            # Keep the old reference, so slow changes still add up
+            return None
+        self.scan_gray = small
+        x1, x2 = xs.min() / scale_x, (xs.max() + 1) / scale_x
+        y1, y2 = ys.min() / scale_y, (ys.max() + 1) / scale_y
+        # Leave room around the moving area, small regions would blow up a face beyond what the detector finds
+        w = max(1.5 * (x2 - x1), self.width / 3.0)
+        h = max(1.5 * (y2 - y1), self.height / 3.0)
+        cx = (x1 + x2) / 2.0
+        cy = (y1 + y2) / 2.0
+        x1, y1 = clamp_to_im((cx - w / 2.0, cy - h / 2.0), self.width, self.height)
+        x2, y2 = clamp_to_im((cx + w / 2.0, cy + h / 2.0), self.width, self.height)
+        return (x1, y1, x2 + 1, y2 + 1)
+
+    def scan_interval(self):
+        # The number of frames between scans for additional faces
+        if self.frame_budget <= 0 or self.scan_cost <= 0:
+            return self.scan_every
+        longest = self.scan_every * self.max_scan_factor
+        left = self.frame_budget - self.last_frame_ms
+        if left <= 0:
+            return longest
+        return min(max(self.scan_every, int(np.ceil(self.scan_cost / left))), longest)
+
+    def scan_faces(self, frame):
+        # Scans for additional faces, without searching the faces that are already tracked when focused_scan is set, returns None when the scan was skipped
+        if not self.focused_scan:
+            return self.detect_faces(frame)
+        region = self.scan_region(frame)
+        if region is None:
+            return None
+        x1, y1, x2, y2 = region
+        masks = [(x - x1, y - y1, w, h) for (x, y, w, h) in self.expand_faces(0.25)]
+        results = self.detect_faces(frame[y1:y2, x1:x2], masks)
+        if results.shape[0] > 0:
+            results[:, 0] += x1
+            results[:, 1] += y1
+        return results
+
+    def search_regions(self, frame):
+        # Runs the face detector on an enlarged region around every face box, which gives the faces a higher resolution than a full frame detection
+        results = []
+        for (x, y, w, h) in self.faces:
+            size = self.search_scale * max(w, h)
+            cx = x + w / 2.0
+            cy = y + h / 2.0
+            x1, y1 = clamp_to_im((cx - size / 2.0, cy - size / 2.0), self.width, self.height)
+            x2, y2 = clamp_to_im((cx + size / 2.0, cy + size / 2.0), self.width, self.height)
+            if x2 - x1 < 16 or y2 - y1 < 16:
+                continue
+            found = self.detect_faces(frame[y1:y2, x1:x2])
+            if found.shape[0] > 0:
+                found[:, 0] += x1
+                found[:, 1] += y1
+                results.extend(found)
+        return results
+
     def landmarks(self, tensor, crop_info):
         crop_x1, crop_y1, scale_x, scale_y, _ = crop_info
         avg_conf = 0
@@ -768,7 +1010,8 @@ class Tracker():
 
         success = False
         if face_info.rotation is not None:
-            success, face_info.rotation, face_info.translation = cv2.solvePnP(face_info.contour, image_pts, self.camera, self.dist_coeffs, useExtrinsicGuess=True, rvec=np.transpose(face_info.rotation), tvec=np.transpose(face_info.translation), flags=cv2.SOLVEPNP_ITERATIVE)
+            # solvePnP writes its result into the guess, copies keep earlier poses handed out with the face intact
+            success, face_info.rotation, face_info.translation = cv2.solvePnP(face_info.contour, image_pts, self.camera, self.dist_coeffs, useExtrinsicGuess=True, rvec=np.transpose(face_info.rotation).copy(), tvec=np.transpose(face_info.translation).copy(), flags=cv2.SOLVEPNP_ITERATIVE)
         else:
             rvec = np.array([0, 0, 0], np.float32)
             tvec = np.array([0, 0, 0], np.float32)
@@ -859,13 +1102,22 @@ class Tracker():
         euler = cv2.RQDecomp3x3(rmat)[0]
         return True, matrix_to_quaternion(rmat), euler, pnp_error, pts_3d, lms
 
-    def preprocess(self, im, crop):
+    def preprocess(self, im, crop, out=None):
         x1, y1, x2, y2 = crop
-        im = np.float32(im[y1:y2, x1:x2,::-1]) # Crop and BGR to RGB
-        im = cv2.resize(im, (self.res_i, self.res_i), interpolation=cv2.INTER_LINEAR) * self.std_res + self.mean_res
-        im = np.expand_dims(im, 0)
-        im = np.transpose(im, (0,3,1,2))
-        return im
+        if self.crop_scratch.shape[0] < y2 - y1 or self.crop_scratch.shape[1] < x2 - x1:
+            self.crop_scratch = np.zeros((max(self.crop_scratch.shape[0], y2 - y1), max(self.crop_scratch.shape[1], x2 - x1), 3), np.float32)
+        scratch = self.crop_scratch[0:y2-y1, 0:x2-x1]
+        np.copyto(scratch, im[y1:y2, x1:x2,::-1]) # Crop, BGR to RGB and convert to float in one pass
+        resized = cv2.resize(scratch, (self.res_i, self.res_i), dst=self.crop_resized, interpolation=cv2.INTER_LINEAR)
+        if out is None:
+            out = np.zeros((1, 3, self.res_i, self.res_i), np.float32)
+        np.multiply(resized.transpose((2,0,1)), self.std_c, out=out[0])
+        np.add(out[0], self.mean_c, out=out[0])
+        return out
+
+    def reserve_crops(self, count):
+        if self.crop_buffer.shape[0] < count:
+            self.crop_buffer = np.zeros((max(count, 2 * self.crop_buffer.shape[0]), 3, self.res_i, self.res_i), np.float32)
 
     def equalize(self, im):
         im_yuv = cv2.cvtColor(im, cv2.COLOR_BGR2YUV)
@@ -884,7 +1136,7 @@ class Tracker():
         lower_right = clamp_to_im(center + radius, w, h)
         return upper_left, lower_right, center, radius, c1, a
 
-    def prepare_eye(self, frame, full_frame, lms, flip):
+    def prepare_eye(self, frame, full_frame, lms, flip, out=None, resized=None):
         outer_pt = tuple(lms[0])
         inner_pt = tuple(lms[1])
         h, w, _ = frame.shape
@@ -896,17 +1148,18 @@ class Tracker():
         if flip:
             im = cv2.flip(im, 1)
         scale = np.array([(x2 - x1), (y2 - y1)]) / 32.
-        im = cv2.resize(im, (32, 32), interpolation=cv2.INTER_LINEAR)
+        im = cv2.resize(im, (32, 32), dst=resized, interpolation=cv2.INTER_LINEAR)
         #im = self.equalize(im)
         if self.debug_gaze:
             if not flip:
                 full_frame[0:32, 0:32] = im
             else:
                 full_frame[0:32, 32:64] = im
-        im = im.astype(np.float32)[:,:,::-1] * self.std_32 + self.mean_32
-        im = np.expand_dims(im, 0)
-        im = np.transpose(im, (0,3,2,1))
-        return im, x1, y1, scale, reference, a
+        if out is None:
+            out = np.zeros((1, 3, 32, 32), np.float32)
+        np.multiply(im[:,:,::-1].transpose((2,1,0)), self.std_c, out=out[0])
+        np.add(out[0], self.mean_c, out=out[0])
+        return out, x1, y1, scale, reference, a
 
     def extract_face(self, frame, lms):
         lms = np.array(lms)[:,0:2][:,::-1]
@@ -924,7 +1177,7 @@ class Tracker():
         frame = frame[y1:y2, x1:x2]
         return frame, lms, offset
 
-    def get_eye_state(self, frame, lms):
+    def get_eye_state(self, frame, lms, context=None):
         if self.no_gaze:
             return [(1.0, 0.0, 0.0, 0.0), (1.0, 0.0, 0.0, 0.0)]
         lms = np.array(lms)
@@ -933,18 +1186,20 @@ class Tracker():
         scale = [0,0]
         reference = [None, None]
         angles = [0, 0]
+        if context is None:
+            context = self.gaze_context
+        both_eyes = context.input
         face_frame, lms, offset = self.extract_face(frame, lms)
-        (right_eye, e_x[0], e_y[0], scale[0], reference[0], angles[0]) = self.prepare_eye(face_frame, frame, np.array([lms[36,0:2], lms[39,0:2]]), False)
-        (left_eye, e_x[1], e_y[1], scale[1], reference[1], angles[1]) = self.prepare_eye(face_frame, frame, np.array([lms[42,0:2], lms[45,0:2]]), True)
+        (right_eye, e_x[0], e_y[0], scale[0], reference[0], angles[0]) = self.prepare_eye(face_frame, frame, np.array([lms[36,0:2], lms[39,0:2]]), False, both_eyes[0:1], context.resized)
+        (left_eye, e_x[1], e_y[1], scale[1], reference[1], angles[1]) = self.prepare_eye(face_frame, frame, np.array([lms[42,0:2], lms[45,0:2]]), True, both_eyes[1:2], context.resized)
         if right_eye is None or left_eye is None:
             return [(1.0, 0.0, 0.0, 0.0), (1.0, 0.0, 0.0, 0.0)]
-        both_eyes = np.concatenate((right_eye, left_eye))
         results = None
-        results = self.gaze_model.run([], {self.input_name: both_eyes})
+        results = context.session.run({self.input_name: both_eyes})
         open = [0, 0]
         open[0] = 1#results[1][0].argmax()
         open[1] = 1#results[1][1].argmax()
-        results = np.array(results[0])
+        results = results[0]
 
         eye_state = []
         for i in range(2):
@@ -1030,15 +1285,67 @@ class Tracker():
             if face_info.frame_count != self.frame_count:
                 face_info.update(None, None, self.frame_count)
 
+    def propagate_faces(self, gray):
+        # Follows the tracked faces from the last keyframe with optical flow, returns False when the landmark model has to run
+        faces = [face_info for face_info in self.face_info if face_info.alive]
+        if self.key_gray is None or self.key_gray.shape != gray.shape or len(faces) == 0 or self.skipped >= self.max_skip:
+            return False
+        if self.detected < self.max_faces and self.wait_count + 1 >= self.scan_interval():
+            return False
+        points_used = 66 if self.no_gaze else 68
+        shifts = []
+        for face_info in faces:
+            if face_info.key_lms is None or face_info.conf <= self.threshold:
+                return False
+            points = np.ascontiguousarray(face_info.key_lms[0:points_used, 1::-1], dtype=np.float32)
+            moved, status, error = cv2.calcOpticalFlowPyrLK(self.key_gray, gray, points, None, winSize=(21, 21), maxLevel=2)
+            if moved is None or not status.all() or np.median(error) > self.max_flow_error:
+                return False
+            # The face as a whole may shift a little, but its features must not move relative to it
+            flow = moved - points
+            shift = np.median(flow, 0)
+            size = points[0:66].max(0) - points[0:66].min(0)
+            limit = self.skip_motion * np.sqrt(max(size[0] * size[1], 1.0))
+            if np.linalg.norm(shift) > limit or np.linalg.norm(flow - shift, axis=1).max() > limit:
+                return False
+            shifts.append(shift)
+        for face_info, (dx, dy) in zip(faces, shifts):
+            face_info.lms = face_info.key_lms[0:66] + np.array([dy, dx, 0.0], np.float32)
+            eye_state = np.array(face_info.key_eye_state, np.float32)
+            eye_state[:, 1] += dy
+            eye_state[:, 2] += dx
+            face_info.eye_state = eye_state
+            face_info.frame_count = self.frame_count
+        self.skipped += 1
+        if self.detected < self.max_faces:
+            self.wait_count += 1
+        return True
+
+    def set_keyframe(self, gray, results):
+        self.key_gray = gray
+        self.skipped = 0
+        for face_info in self.face_info:
+            face_info.key_lms = None
+            face_info.key_eye_state = None
+        for face_info in results:
+            face_info.key_lms = np.array(face_info.lms)
+            face_info.key_eye_state = np.array(face_info.eye_state)
+
     def predict(self, frame, additional_faces=[]):
         self.frame_count += 1
         start = time.perf_counter()
         im = frame
 
+        gray = None
+        if self.max_skip > 0:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if self.propagate_faces(gray):
+                duration_flow = 1000 * (time.perf_counter() - start)
+                return self.finish_frame(start, 0.0, 0.0, duration_flow, 0)
+
         duration_fd = 0.0
         duration_pp = 0.0
         duration_model = 0.0
-        duration_pnp = 0.0
 
         new_faces = []
         new_faces.extend(self.faces)
@@ -1046,32 +1353,61 @@ class Tracker():
         new_faces.extend(additional_faces)
         self.wait_count += 1
         if self.detected == 0:
+            if not self.idle_skip(frame):
+                self.metrics.event("detect", self.frame_count)
+                start_fd = time.perf_counter()
+                if self.use_retinaface > 0 or self.try_hard:
+                    retinaface_detections = self.retinaface.detect_retina(frame)
+                    new_faces.extend(retinaface_detections)
+                if self.use_retinaface == 0 or self.try_hard:
+                    new_faces.extend(self.detect_faces(frame))
+                if self.try_hard:
+                    new_faces.extend([(0, 0, self.width, self.height)])
+                duration_fd = 1000 * (time.perf_counter() - start_fd)
+                self.wait_count = 0
+        elif self.local_search and self.discard > 0:
+            # All faces were lost recently, the whole frame is only searched once discard_after runs out
+            self.metrics.event("search", self.frame_count)
             start_fd = time.perf_counter()
-            if self.use_retinaface > 0 or self.try_hard:
-                retinaface_detections = self.retinaface.detect_retina(frame)
-                new_faces.extend(retinaface_detections)
-            if self.use_retinaface == 0 or self.try_hard:
-                new_faces.extend(self.detect_faces(frame))
-            if self.try_hard:
-                new_faces.extend([(0, 0, self.width, self.height)])
+            new_faces.extend(self.search_regions(frame))
             duration_fd = 1000 * (time.perf_counter() - start_fd)
-            self.wait_count = 0
         elif self.detected < self.max_faces:
             if self.use_retinaface > 0:
                 new_faces.extend(self.retinaface_scan.get_results())
-            if self.wait_count >= self.scan_every:
+            if self.wait_count >= self.scan_interval():
                 if self.use_retinaface > 0:
-                    self.retinaface_scan.background_detect(frame)
+                    retinaface_scan = self.retinaface_scan
+                    if not retinaface_scan.running and not retinaface_scan.finished:
+                        # Motion and masks are only looked at once a new scan can start, so changes seen while a scan runs are kept for the next one
+                        if not self.focused_scan:
+                            self.metrics.event("rescan", self.frame_count)
+                            retinaface_scan.background_detect(frame)
+                        else:
+                            if self.scan_region(frame) is not None:
+                                self.metrics.event("rescan", self.frame_count)
+                                # RetinaFace always works on the whole frame, so only the tracked faces are blanked out
+                                masked = frame.copy()
+                                for (x, y, w, h) in self.expand_faces(0.25):
+                                    x1, y1 = clamp_to_im((x, y), self.width, self.height)
+                                    x2, y2 = clamp_to_im((x + w + 1, y + h + 1), self.width, self.height)
+                                    masked[y1:y2, x1:x2] = 0
+                                retinaface_scan.background_detect(masked)
+                            self.wait_count = 0
                 else:
                     start_fd = time.perf_counter()
-                    new_faces.extend(self.detect_faces(frame))
+                    found = self.scan_faces(frame)
                     duration_fd = 1000 * (time.perf_counter() - start_fd)
+                    if found is not None:
+                        self.metrics.event("rescan", self.frame_count)
+                        new_faces.extend(found)
+                        self.scan_cost = duration_fd if self.scan_cost <= 0 else 0.9 * self.scan_cost + 0.1 * duration_fd
                     self.wait_count = 0
         else:
             self.wait_count = 0
 
         if len(new_faces) < 1:
             duration = (time.perf_counter() - start) * 1000
+            self.metrics.record_frame(self.frame_count, duration_fd, 0.0, 0.0, 0.0, duration, 0, 0)
             if not self.silent:
                 print(f"Took {duration:.2f}ms")
             return []
@@ -1079,6 +1415,7 @@ class Tracker():
         crops = []
         crop_info = []
         num_crops = 0
+        self.reserve_crops(len(new_faces))
         for j, (x,y,w,h) in enumerate(new_faces):
             crop_x1 = x - int(w * 0.1)
             crop_y1 = y - int(h * 0.125)
@@ -1095,7 +1432,7 @@ class Tracker():
                 continue
 
             start_pp = time.perf_counter()
-            crop = self.preprocess(im, (crop_x1, crop_y1, crop_x2, crop_y2))
+            crop = self.preprocess(im, (crop_x1, crop_y1, crop_x2, crop_y2), self.crop_buffer[num_crops:num_crops+1])
             duration_pp += 1000 * (time.perf_counter() - start_pp)
             crops.append(crop)
             crop_info.append((crop_x1, crop_y1, scale_x, scale_y, 0.0 if j >= bonus_cutoff else 0.1))
@@ -1104,7 +1441,7 @@ class Tracker():
         start_model = time.perf_counter()
         outputs = {}
         if num_crops == 1:
-            output = self.session.run([], {self.input_name: crops[0]})[0]
+            output = self.bound_session.run({self.input_name: crops[0]})[0]
             conf, lms = self.landmarks(output[0], crop_info[0])
             if conf > self.threshold:
                 try:
@@ -1112,26 +1449,24 @@ class Tracker():
                 except:
                     eye_state = [(1.0, 0.0, 0.0, 0.0), (1.0, 0.0, 0.0, 0.0)]
                 outputs[crop_info[0]] = (conf, (lms, eye_state), 0)
+        elif self.batch_inference:
+            output = self.bound_session.run({self.input_name: self.crop_buffer[0:num_crops]})[0]
+            for i in range(num_crops):
+                conf, lms = self.landmarks(output[i], crop_info[i])
+                if conf > self.threshold:
+                    try:
+                        eye_state = self.get_eye_state(frame, lms)
+                    except:
+                        eye_state = [(1.0, 0.0, 0.0, 0.0), (1.0, 0.0, 0.0, 0.0)]
+                    outputs[crop_info[i]] = (conf, (lms, eye_state), i)
         else:
-            started = 0
-            results = queue.Queue()
-            for i in range(min(num_crops, self.max_workers)):
-                thread = threading.Thread(target=worker_thread, args=(self.sessions[started], frame, crops[started], crop_info[started], results, self.input_name, started, self))
-                started += 1
-                thread.start()
-            returned = 0
-            while returned < num_crops:
-                result = results.get(True)
-                if len(result) != 1:
-                    session, conf, lms, sample_crop_info, idx = result
+            for i in range(num_crops):
+                self.jobs.put((frame, crops[i], crop_info[i], i))
+            for i in range(num_crops):
+                result = self.results.get(True)
+                if result is not None:
+                    conf, lms, sample_crop_info, idx = result
                     outputs[sample_crop_info] = (conf, lms, idx)
-                else:
-                    session = result[0]
-                returned += 1
-                if started < num_crops:
-                    thread = threading.Thread(target=worker_thread, args=(session, frame, crops[started], crop_info[started], results, self.input_name, started, self))
-                    started += 1
-                    thread.start()
 
         actual_faces = []
         good_crops = []
@@ -1161,9 +1496,23 @@ class Tracker():
                 best_results[group_id][2] = crop[4]
 
         sorted_results = sorted(best_results.values(), key=lambda x: x[0], reverse=True)[:self.max_faces]
+        was_alive = [face_info.alive for face_info in self.face_info]
         self.assign_face_info(sorted_results)
+        for face_info, alive in zip(self.face_info, was_alive):
+            if face_info.alive and not alive:
+                self.metrics.event("found", self.frame_count, face_info.id)
+            elif alive and not face_info.alive:
+                self.metrics.event("lost", self.frame_count, face_info.id)
         duration_model = 1000 * (time.perf_counter() - start_model)
 
+        results = self.finish_frame(start, duration_fd, duration_pp, duration_model, num_crops)
+        if gray is not None:
+            self.set_keyframe(gray, results)
+        return results
+
+    def finish_frame(self, start, duration_fd, duration_pp, duration_model, num_crops):
+        # Fits the 3D model to the tracked faces, places the crops for the next frame and returns the tracked faces
+        duration_pnp = 0.0
         results = []
         detected = []
         start_pnp = time.perf_counter()
@@ -1176,21 +1525,33 @@ class Tracker():
                 x2, y2 = tuple(lms[0:66].max(0))
                 bbox = (y1, x1, y2 - y1, x2 - x1)
                 face_info.bbox = bbox
-                detected.append(bbox)
+                if self.motion_model:
+                    face_info.motion.update(bbox)
+                    detected.append(face_info.motion.predict())
+                else:
+                    detected.append(bbox)
                 results.append(face_info)
+                self.metrics.record_face(face_info.id, face_info.conf, face_info.success, self.frame_count)
         duration_pnp += 1000 * (time.perf_counter() - start_pnp)
 
         if len(detected) > 0:
             self.detected = len(detected)
             self.faces = detected
+            self.motion_faces = results
             self.discard = 0
+            self.idle_step = 1
+            self.idle_wait = 0
         else:
             self.detected = 0
             self.discard += 1
             if self.discard > self.discard_after:
                 self.faces = []
+                self.motion_faces = []
             else:
-                if self.bbox_growth > 0:
+                if self.motion_model:
+                    # Keep following the lost faces, their crops grow with the uncertainty
+                    self.faces = [face_info.motion.predict() for face_info in self.motion_faces]
+                elif self.bbox_growth > 0:
                     faces = []
                     for (x,y,w,h) in self.faces:
                         x -= w * self.bbox_growth
@@ -1203,9 +1564,18 @@ class Tracker():
         self.detected = len(self.faces)
 
         duration = (time.perf_counter() - start) * 1000
+        self.last_frame_ms = duration - duration_fd
+        self.metrics.record_frame(self.frame_count, duration_fd, duration_pp, duration_model, duration_pnp, duration, len(results), num_crops)
         if not self.silent:
             print(f"Took {duration:.2f}ms (detect: {duration_fd:.2f}ms, crop: {duration_pp:.2f}ms, track: {duration_model:.2f}ms, 3D points: {duration_pnp:.2f}ms)")
 
         results = sorted(results, key=lambda x: x.id)
 
         return results
+
+    def close(self):
+        for worker in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
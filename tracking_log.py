@@ -0,0 +1,461 @@
+# =============================================================================
+# Tracking Data Logs for OpenSeeFace
+# =============================================================================
+#
+# Writing of the tracking data log enabled with --log-data. Every entry
+# describes one face in one frame: frame and face information, head pose,
+# the 68 landmarks as (y, x, confidence), the 70 3D points as (x, -y, -z)
+# and the expression features.
+#
+# Two formats are supported:
+#
+#     csv     One text row per face, ending with "\r\n", under a header row.
+#     binary  A small header followed by fixed-size little-endian records of
+#             the log_record dtype, which can be memory-mapped directly.
+#
+# The binary header is the 8 byte magic b"OSFTRACK", the length of a JSON
+# header as a little-endian uint32 and the JSON header itself, padded with
+# spaces so that the records start at a multiple of 64 bytes. The JSON
+# header holds the format version, the record dtype description and the
+# feature names.
+#
+# TrackingLogWriter formats and writes entries on a background thread and
+# flushes in batches, so logging does not hold up tracking. Binary logs can
+# be converted to CSV with:
+#
+#     python tracking_log.py tracking.osflog tracking.csv
+#
+# TrackingLog memory-maps a binary log for analysis. Its fields are NumPy
+# views of the file, and slicing by frame or time range stays a view, so
+# even multi-hour logs open instantly and are only paged in as needed.
+#
+# Usage:
+#     log = TrackingLogWriter("tracking.osflog", format="binary")
+#     log.write_face(frame_count, now, width, height, fps, face_num, face)
+#     log.close()
+#
+#     log = TrackingLog("tracking.osflog")
+#     first_minute = log.between(log.time[0], log.time[0] + 60.0)
+#     mouth_open = first_minute.face(0).feature("mouth_open")
+#
+# License: BSD 2-clause
+# =============================================================================
+
+import argparse
+import copy
+import csv
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from packet import features
+
+MAGIC = b"OSFTRACK"
+VERSION = 1
+ALIGNMENT = 64
+
+log_record = np.dtype([
+    ("frame", "<i8"),
+    ("time", "<f8"),
+    ("width", "<i4"),
+    ("height", "<i4"),
+    ("fps", "<f4"),
+    ("face", "<i4"),
+    ("face_id", "<i4"),
+    ("eye_blink", "<f4", (2,)),
+    ("conf", "<f4"),
+    ("success", "u1"),
+    ("pnp_error", "<f4"),
+    ("quaternion", "<f4", (4,)),
+    ("euler", "<f4", (3,)),
+    ("rotation", "<f4", (3,)),
+    ("translation", "<f4", (3,)),
+    ("landmarks", "<f4", (68, 3)),
+    ("points", "<f4", (70, 3)),
+    ("features", "<f4", (len(features),)),
+])
+
+# Reorders landmarks from (x, y, confidence) to the logged (y, x, confidence)
+landmark_order = [1, 0, 2]
+flip_yz = np.array([1, -1, -1], np.float32)
+
+
+def csv_header():
+    header = ["Frame,Time,Width,Height,FPS,Face,FaceID,RightOpen,LeftOpen,AverageConfidence,Success3D,PnPError,RotationQuat.X,RotationQuat.Y,RotationQuat.Z,RotationQuat.W,Euler.X,Euler.Y,Euler.Z,RVec.X,RVec.Y,RVec.Z,TVec.X,TVec.Y,TVec.Z"]
+    for i in range(68):
+        header.append(f",Landmark[{i}].X,Landmark[{i}].Y,Landmark[{i}].Confidence")
+    for i in range(70):
+        header.append(f",Point3D[{i}].X,Point3D[{i}].Y,Point3D[{i}].Z")
+    for feature in features:
+        header.append(f",{feature}")
+    header.append("\r\n")
+    return "".join(header)
+
+
+def csv_row(frame_count, now, width, height, fps, face_num, f):
+    # The face needs eye_blink and all current_features set, as facetracker.py does before sending
+    row = [f"{frame_count},{now},{width},{height},{fps},{face_num},{f.id},{f.eye_blink[0]},{f.eye_blink[1]},{f.conf},{f.success},{f.pnp_error},{f.quaternion[0]},{f.quaternion[1]},{f.quaternion[2]},{f.quaternion[3]},{f.euler[0]},{f.euler[1]},{f.euler[2]},{f.rotation[0]},{f.rotation[1]},{f.rotation[2]},{f.translation[0]},{f.translation[1]},{f.translation[2]}"]
+    for (x,y,c) in f.lms:
+        row.append(f",{y},{x},{c}")
+    for (x,y,z) in f.pts_3d:
+        row.append(f",{x},{-y},{-z}")
+    for feature in features:
+        row.append(f",{f.current_features[feature]}")
+    row.append("\r\n")
+    return "".join(row)
+
+
+def fill_record(records, index, frame_count, now, width, height, fps, face_num, f):
+    # Store one face in records[index], with the same requirements as csv_row
+    records["frame"][index] = frame_count
+    records["time"][index] = now
+    records["width"][index] = width
+    records["height"][index] = height
+    records["fps"][index] = fps
+    records["face"][index] = face_num
+    records["face_id"][index] = f.id
+    records["eye_blink"][index] = f.eye_blink[0:2]
+    records["conf"][index] = f.conf
+    records["success"][index] = 1 if f.success else 0
+    records["pnp_error"][index] = f.pnp_error
+    records["quaternion"][index] = f.quaternion[0:4]
+    records["euler"][index] = f.euler[0:3]
+    records["rotation"][index] = np.reshape(f.rotation, (3,))
+    records["translation"][index] = np.reshape(f.translation, (3,))
+    records["landmarks"][index] = np.asarray(f.lms)[:, landmark_order]
+    np.multiply(f.pts_3d, flip_yz, out=records["points"][index])
+    records["features"][index] = [f.current_features[feature] for feature in features]
+
+
+def snapshot_face(f):
+    # A copy of the face with its own pose arrays, a pose reset after a failed 3D fit is logged as zeros
+    f = copy.copy(f)
+    f.rotation = np.zeros(3, np.float32) if f.rotation is None else np.array(f.rotation)
+    f.translation = np.zeros(3, np.float32) if f.translation is None else np.array(f.translation)
+    return f
+
+
+def make_records(entries):
+    # entries are (frame_count, now, width, height, fps, face_num, face) tuples
+    records = np.zeros((len(entries),), log_record)
+    for i, entry in enumerate(entries):
+        fill_record(records, i, *entry)
+    return records
+
+
+def binary_header():
+    header = json.dumps({"format": "openseeface-tracking-log", "version": VERSION, "dtype": log_record.descr, "features": features}).encode("utf-8")
+    length = len(MAGIC) + 4 + len(header)
+    padding = (ALIGNMENT - length % ALIGNMENT) % ALIGNMENT
+    header += b" " * padding
+    return MAGIC + np.uint32(len(header)).astype("<u4").tobytes() + header
+
+
+def read_binary_header(fh):
+    # Returns the parsed JSON header and the offset of the first record
+    magic = fh.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("Not a binary tracking data log")
+    length = int(np.frombuffer(fh.read(4), "<u4")[0])
+    header = json.loads(fh.read(length).decode("utf-8"))
+    if header.get("version") != VERSION:
+        raise ValueError(f"Unsupported tracking data log version {header.get('version')}")
+    return header, len(MAGIC) + 4 + length
+
+
+def records_to_csv(records):
+    # Format records as CSV rows, floats are written with their shortest float32 representation
+    fixed = np.concatenate([
+        records["eye_blink"],
+        records["conf"][:, np.newaxis],
+    ], 1).astype(str)
+    pose = np.concatenate([
+        records["quaternion"],
+        records["euler"],
+        records["rotation"],
+        records["translation"],
+    ], 1).astype(str)
+    values = np.concatenate([
+        records["landmarks"].reshape((-1, 68 * 3)),
+        records["points"].reshape((-1, 70 * 3)),
+        records["features"],
+    ], 1).astype(str)
+    pnp_error = records["pnp_error"].astype(str)
+    rows = []
+    for i, r in enumerate(records):
+        rows.append(f"{r['frame']},{float(r['time'])!r},{r['width']},{r['height']},{r['fps']:g},{r['face']},{r['face_id']},{','.join(fixed[i])},{bool(r['success'])},{pnp_error[i]},{','.join(pose[i])},{','.join(values[i])}\r\n")
+    return "".join(rows)
+
+
+def convert_to_csv(binary_path, csv_path, chunk=4096):
+    with open(binary_path, "rb") as fh:
+        header, offset = read_binary_header(fh)
+        with open(csv_path, "w") as out:
+            out.write(csv_header())
+            while True:
+                data = fh.read(chunk * log_record.itemsize)
+                if len(data) < log_record.itemsize:
+                    break
+                count = len(data) // log_record.itemsize
+                out.write(records_to_csv(np.frombuffer(data[0:count * log_record.itemsize], log_record)))
+
+
+def read_csv(path):
+    # Parse a CSV tracking data log into log records
+    with open(path, "r", newline="") as fh:
+        reader = csv.reader(fh)
+        next(reader, None)
+        rows = [row for row in reader if len(row) > 0]
+    records = np.zeros((len(rows),), log_record)
+    for i, row in enumerate(rows):
+        records["frame"][i] = int(row[0])
+        records["time"][i] = float(row[1])
+        records["width"][i] = int(row[2])
+        records["height"][i] = int(row[3])
+        records["fps"][i] = float(row[4])
+        records["face"][i] = int(row[5])
+        records["face_id"][i] = int(row[6])
+        records["success"][i] = 1 if row[10] == "True" else 0
+        values = np.array([row[7:10] + row[11:]], np.float64)[0]
+        records["eye_blink"][i] = values[0:2]
+        records["conf"][i] = values[2]
+        records["pnp_error"][i] = values[3]
+        records["quaternion"][i] = values[4:8]
+        records["euler"][i] = values[8:11]
+        records["rotation"][i] = values[11:14]
+        records["translation"][i] = values[14:17]
+        records["landmarks"][i] = values[17:221].reshape((68, 3))
+        records["points"][i] = values[221:431].reshape((70, 3))
+        records["features"][i] = values[431:431 + len(features)]
+    return records
+
+
+def read_records(path):
+    # Load log records from a binary log, memory-mapped, or from a CSV log
+    with open(path, "rb") as fh:
+        binary = fh.read(len(MAGIC)) == MAGIC
+    if binary:
+        return TrackingLog(path).records
+    return read_csv(path)
+
+
+class TrackingLog():
+    def __init__(self, path, records=None):
+        self.path = path
+        if records is None:
+            with open(path, "rb") as fh:
+                self.header, offset = read_binary_header(fh)
+            # A log that is still being written may end in a partial record
+            count = (os.path.getsize(path) - offset) // log_record.itemsize
+            if count > 0:
+                records = np.memmap(path, dtype=log_record, mode="r", offset=offset, shape=(count,))
+            else:
+                records = np.zeros((0,), log_record)
+        self.records = records
+
+    def subset(self, records):
+        log = TrackingLog(self.path, records)
+        log.header = self.header
+        return log
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    # Every field is a view of the records, landmarks are (y, x, confidence) and points are (x, -y, -z)
+    @property
+    def frame(self):
+        return self.records["frame"]
+
+    @property
+    def time(self):
+        return self.records["time"]
+
+    @property
+    def face_id(self):
+        return self.records["face_id"]
+
+    @property
+    def eye_blink(self):
+        return self.records["eye_blink"]
+
+    @property
+    def conf(self):
+        return self.records["conf"]
+
+    @property
+    def success(self):
+        return self.records["success"]
+
+    @property
+    def pnp_error(self):
+        return self.records["pnp_error"]
+
+    @property
+    def quaternion(self):
+        return self.records["quaternion"]
+
+    @property
+    def euler(self):
+        return self.records["euler"]
+
+    @property
+    def rotation(self):
+        return self.records["rotation"]
+
+    @property
+    def translation(self):
+        return self.records["translation"]
+
+    @property
+    def landmarks(self):
+        return self.records["landmarks"]
+
+    @property
+    def pts_3d(self):
+        return self.records["points"]
+
+    @property
+    def features(self):
+        return self.records["features"]
+
+    def feature(self, name):
+        return self.records["features"][:, features.index(name)]
+
+    def face_ids(self):
+        return np.unique(self.records["face_id"])
+
+    def frames(self, first, last=None):
+        # Entries of the frames first to last inclusive, as a view
+        if last is None:
+            last = first
+        frame = self.records["frame"]
+        start = np.searchsorted(frame, first, side="left")
+        end = np.searchsorted(frame, last, side="right")
+        return self.subset(self.records[start:end])
+
+    def between(self, start_time, end_time):
+        # Entries with start_time <= time < end_time, as a view
+        time = self.records["time"]
+        start = np.searchsorted(time, start_time, side="left")
+        end = np.searchsorted(time, end_time, side="left")
+        return self.subset(self.records[start:end])
+
+    def face(self, face_id):
+        # Entries of one face id. Unless the log only holds that face, this copies the selected records.
+        face_ids = self.records["face_id"]
+        if face_ids.shape[0] > 0 and face_ids[0] == face_id and face_ids[-1] == face_id and (face_ids == face_id).all():
+            return self.subset(self.records)
+        return self.subset(self.records[face_ids == face_id])
+
+
+class TrackingLogWriter():
+    def __init__(self, path, format="csv", flush_interval=1.0):
+        if format not in ("csv", "binary"):
+            raise ValueError(f"Unknown tracking data log format {format}")
+        self.format = format
+        self.flush_interval = flush_interval
+        if format == "binary":
+            self.fh = open(path, "wb")
+            self.fh.write(binary_header())
+        else:
+            self.fh = open(path, "w")
+            self.fh.write(csv_header())
+        self.fh.flush()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="tracking log", daemon=True)
+        self.thread.start()
+
+    def write_face(self, frame_count, now, width, height, fps, face_num, f):
+        # The face is formatted later on the writer thread, so its pose is copied now.
+        # The other values logged are replaced by the tracker every frame, not modified.
+        self.queue.put((frame_count, now, width, height, fps, face_num, snapshot_face(f)))
+
+    def write_block(self, block):
+        # Write preformatted CSV text or an array of log records
+        self.queue.put(block)
+
+    def write_entries(self, entries):
+        # A face that cannot be formatted is left out, without losing the rest of the batch
+        if len(entries) == 0:
+            return
+        if self.format == "binary":
+            records = np.zeros((len(entries),), log_record)
+            good = np.ones((len(entries),), bool)
+            for i, entry in enumerate(entries):
+                try:
+                    fill_record(records, i, *entry)
+                except Exception:
+                    traceback.print_exc()
+                    good[i] = False
+            self.fh.write(records[good].tobytes())
+        else:
+            rows = []
+            for entry in entries:
+                try:
+                    rows.append(csv_row(*entry))
+                except Exception:
+                    traceback.print_exc()
+            self.fh.write("".join(rows))
+
+    def write_items(self, items):
+        entries = []
+        for item in items:
+            if isinstance(item, tuple):
+                entries.append(item)
+                continue
+            self.write_entries(entries)
+            entries = []
+            if isinstance(item, np.ndarray):
+                self.fh.write(item.astype(log_record, copy=False).tobytes())
+            else:
+                self.fh.write(item)
+        self.write_entries(entries)
+
+    def run(self):
+        last_flush = time.perf_counter()
+        running = True
+        while running:
+            # Gather everything queued so far into one write
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for i, item in enumerate(items):
+                if item is None:
+                    running = False
+                    items = items[0:i]
+                    break
+            try:
+                self.write_items(items)
+                now = time.perf_counter()
+                if not running or now - last_flush >= self.flush_interval:
+                    self.fh.flush()
+                    last_flush = now
+            except Exception:
+                traceback.print_exc()
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.fh.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a binary tracking data log to CSV")
+    parser.add_argument("input", help="Binary tracking data log")
+    parser.add_argument("output", help="CSV file to write")
+    args = parser.parse_args()
+    convert_to_csv(args.input, args.output)
@@ -21,6 +21,24 @@
 #     - Availability status: /VMC/Ext/OK
 #     - Time synchronization: /VMC/Ext/T
 #
+# Bundling:
+#     All messages for a tracked face are collected into OSC bundles that are
+#     sent with one UDP datagram each, instead of one datagram per message.
+#     Bundles are split so each stays within max_bundle_size bytes, which by
+#     default fits a single Ethernet frame and avoids IP fragmentation. The
+#     OSC encoding is done here directly; the encoded address, type tags and
+#     name of every blend shape and bone are cached, so a message only needs
+#     its values packed.
+#
+# Blend Shape Updates:
+#     Blend shape values are collected until the next Apply, keeping only the
+#     last value set for every name. Of these, only values that moved by more
+#     than blend_epsilon since they were last sent go out. Every
+#     keyframe_interval seconds the whole blend shape state is sent again, so
+#     receivers that started late or lost packets catch up. What was sent is
+#     tracked for every target on its own, and a newly added target starts
+#     with a keyframe. Targets that need the same values share a datagram.
+#
 # Blend Shape Mappings:
 #     This sender outputs both ARKit-style blend shapes (eyeBlinkLeft, etc.)
 #     and VRM-style blend shapes (Blink_L, A, etc.) for broad compatibility.
@@ -29,49 +47,168 @@
 #     from vmc_sender import VMCSender
 #     
 #     sender = VMCSender(ip="127.0.0.1", port=39539)
+#     sender.add_target("192.168.1.20", 39540)
 #     sender.send_tracking_data(face_info)
 #
 # Author: OpenSeeFace Contributors
 # License: BSD 2-clause
 # =============================================================================
 
-from pythonosc import udp_client
-from pythonosc.osc_bundle_builder import OscBundleBuilder, IMMEDIATELY
-from pythonosc.osc_message_builder import OscMessageBuilder
 import math
+import socket
+import struct
 import time
 
+# Largest UDP payload that fits into an Ethernet frame (1500 byte MTU) without fragmentation
+MAX_BUNDLE_SIZE = 1472
+
+# Default change threshold for blend shapes and seconds between full blend shape updates
+BLEND_EPSILON = 0.005
+KEYFRAME_INTERVAL = 1.0
+
+# Bundle header with the time tag 1, which means "immediately"
+BUNDLE_HEADER = b"#bundle\0" + struct.pack(">Q", 1)
+
+pack_size = struct.Struct(">i").pack
+pack_float = struct.Struct(">f").pack
+pack_transform = struct.Struct(">7f").pack
+pack_status = struct.Struct(">3i").pack
+
+
+def osc_string(value):
+    # OSC strings are null terminated and padded to a multiple of 4 bytes
+    data = value.encode("utf-8") + b"\0"
+    return data + b"\0" * (-len(data) % 4)
+
 
 class VMCSender:
-    def __init__(self, ip="127.0.0.1", port=39539):
-        self.client = udp_client.SimpleUDPClient(ip, port)
+    def __init__(self, ip="127.0.0.1", port=39539, max_bundle_size=MAX_BUNDLE_SIZE, blend_epsilon=BLEND_EPSILON, keyframe_interval=KEYFRAME_INTERVAL):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.ip = ip
         self.port = port
+        # Every datagram is sent to all targets
+        self.addresses = [(ip, port)]
         self.start_time = time.time()
-        
+        self.max_bundle_size = max_bundle_size
+        self.prefixes = {}
+        # Elements of the bundle being built, each preceded by its size
+        self.elements = []
+        self.bundle_size = len(BUNDLE_HEADER)
+        self.bundling = 0
+        self.datagrams_sent = 0
+        # Blend shape values last sent and time of the last keyframe for every target, and the values set since the last apply
+        self.blend_state = {(ip, port): {}}
+        self.last_keyframe = {(ip, port): None}
+        self.blend_values = {}
+        self.blend_epsilon = blend_epsilon
+        self.keyframe_interval = keyframe_interval
+
+    def prefix(self, address, tags, name=None):
+        # Encoded address, type tags and leading string argument of a message
+        key = (address, name)
+        prefix = self.prefixes.get(key)
+        if prefix is None:
+            prefix = osc_string(address) + osc_string("," + tags)
+            if name is not None:
+                prefix += osc_string(name)
+            self.prefixes[key] = prefix
+        return prefix
+
+    def add_target(self, ip, port):
+        # Send the same data to another receiver, its blend shapes start with a keyframe
+        self.addresses.append((ip, port))
+        self.blend_state.setdefault((ip, port), {})
+        self.last_keyframe.setdefault((ip, port), None)
+
+    def send_datagram(self, data):
+        for address in self.addresses:
+            self.sock.sendto(data, address)
+        self.datagrams_sent += 1
+
+    def add_message(self, message):
+        # Outside of a bundle, messages are sent on their own
+        if self.bundling == 0:
+            self.send_datagram(message)
+            return
+        size = 4 + len(message)
+        if len(self.elements) > 0 and self.bundle_size + size > self.max_bundle_size:
+            self.flush()
+        self.elements.append(pack_size(len(message)))
+        self.elements.append(message)
+        self.bundle_size += size
+
+    def flush(self):
+        # Send the messages collected so far as one bundle
+        if len(self.elements) == 0:
+            return
+        self.elements.insert(0, BUNDLE_HEADER)
+        self.send_datagram(b"".join(self.elements))
+        self.elements = []
+        self.bundle_size = len(BUNDLE_HEADER)
+
+    def begin_bundle(self):
+        # Messages are collected until the matching end_bundle, calls can be nested
+        self.bundling += 1
+
+    def end_bundle(self):
+        self.bundling -= 1
+        if self.bundling == 0:
+            self.flush()
+
     def send_blend_shape(self, name, value):
-        # Send a single blend shape value
-        self.client.send_message("/VMC/Ext/Blend/Val", [name, float(value)])
+        # Set a single blend shape value, it is sent by the next send_blend_shape_apply
+        self.blend_values[name] = float(value)
     
+    def blend_changes(self, address, now):
+        # The blend shape values a target needs, all of them for a keyframe
+        state = self.blend_state[address]
+        last_keyframe = self.last_keyframe[address]
+        if last_keyframe is None or now - last_keyframe >= self.keyframe_interval:
+            self.last_keyframe[address] = now
+            state.update(self.blend_values)
+            return tuple(state.items())
+        changed = tuple((name, value) for name, value in self.blend_values.items() if not name in state or abs(value - state[name]) > self.blend_epsilon)
+        state.update(changed)
+        return changed
+
     def send_blend_shape_apply(self):
-        # Signal that blend shape updates are complete
-        self.client.send_message("/VMC/Ext/Blend/Apply", [])
+        # Send the blend shape values that changed, or all of them for a keyframe, and signal that blend shape updates are complete
+        now = time.perf_counter()
+        changes = {address: self.blend_changes(address, now) for address in dict.fromkeys(self.addresses)}
+        self.blend_values.clear()
+        groups = {}
+        for address in self.addresses:
+            groups.setdefault(changes[address], []).append(address)
+        if len(groups) == 1:
+            self.add_blend_shapes(next(iter(groups)))
+            return
+        # Targets that need different values get their own bundles, after everything collected so far went out to all of them
+        self.flush()
+        addresses = self.addresses
+        try:
+            for changed, group in groups.items():
+                self.addresses = group
+                self.add_blend_shapes(changed)
+                self.flush()
+        finally:
+            self.addresses = addresses
+
+    def add_blend_shapes(self, changed):
+        for name, value in changed:
+            self.add_message(self.prefix("/VMC/Ext/Blend/Val", "sf", name) + pack_float(value))
+        self.add_message(self.prefix("/VMC/Ext/Blend/Apply", ""))
     
     def send_bone_transform(self, bone_name, px, py, pz, qx, qy, qz, qw):
         # Send bone position and rotation
-        self.client.send_message("/VMC/Ext/Bone/Pos", [
-            bone_name,
-            float(px), float(py), float(pz),
-            float(qx), float(qy), float(qz), float(qw)
-        ])
+        self.add_message(self.prefix("/VMC/Ext/Bone/Pos", "sfffffff", bone_name) + pack_transform(px, py, pz, qx, qy, qz, qw))
     
     def send_available(self, available=1, calibration_state=0, tracking_status=0):
         # Send availability status - VMC/Ext/OK format
-        self.client.send_message("/VMC/Ext/OK", [available, calibration_state, tracking_status])
+        self.add_message(self.prefix("/VMC/Ext/OK", "iii") + pack_status(available, calibration_state, tracking_status))
     
     def send_time(self, time_val):
         # Send current time
-        self.client.send_message("/VMC/Ext/T", [float(time_val)])
+        self.add_message(self.prefix("/VMC/Ext/T", "f") + pack_float(time_val))
     
     def euler_to_quaternion(self, pitch, yaw, roll):
         # Convert Euler angles (in degrees) to quaternion for Unity
@@ -97,11 +234,10 @@ class VMCSender:
     def send_root_transform(self):
         # Send root transform (required by some apps)
         # Send a neutral root position
-        self.client.send_message("/VMC/Ext/Root/Pos", [
-            "root",
+        self.add_message(self.prefix("/VMC/Ext/Root/Pos", "sfffffff", "root") + pack_transform(
             0.0, 0.0, 0.0,  # position
             0.0, 0.0, 0.0, 1.0  # quaternion (identity)
-        ])
+        ))
     
     def send_tracking_data(self, face):
         # Send face tracking data in VMC format
@@ -109,6 +245,14 @@ class VMCSender:
         if face is None:
             return
         
+        # Everything for this face goes out in as few bundles as possible
+        self.begin_bundle()
+        try:
+            self.add_face(face)
+        finally:
+            self.end_bundle()
+
+    def add_face(self, face):
         # Send availability (loaded=1, calibration_state=3 means calibrated, tracking=1)
         self.send_available(1 if face.success else 0, 3, 1)
         